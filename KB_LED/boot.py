@@ -0,0 +1,4 @@
+import usb_cdc
+
+# second CDC port carries the cpm_link bridge, the REPL stays on the console port
+usb_cdc.enable(console=True, data=True)
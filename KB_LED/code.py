@@ -3,11 +3,14 @@ import busio
 import displayio
 import i2cdisplaybus
 import neopixel
+import sys
 import time
 import supervisor
+import usb_cdc
 
 import tlc5940
 import cpm_screen
+import cpm_link
 
 supervisor.runtime.autoreload = False
 displayio.release_displays()
@@ -33,11 +36,38 @@ led_driver = tlc5940.TLC5940(spi,
                              gsclk_pin=board.D5,
                              xlat_pin = board.D10)
 
-while True:
-    for led in range(16):
-        for shift in range(11):
-            led_driver.set_gs_led_data(led, 0xFFF >>shift)
-            led_driver.program()
-            time.sleep(0.1)
-        else:
-            led_driver.set_gs_led_data(led, 0xFFF)
\ No newline at end of file
+def led_sweep():
+    while True:
+        for led in range(16):
+            for shift in range(11):
+                led_driver.set_gs_led_data(led, 0xFFF >>shift)
+                led_driver.program()
+                time.sleep(0.1)
+            else:
+                led_driver.set_gs_led_data(led, 0xFFF)
+
+def bridge(serial):
+    # host drives the screen and LEDs, keys typed on the REPL console go back
+    decoder = cpm_link.FrameDecoder()
+    encoder = cpm_link.FrameEncoder()
+    pixel.fill((0, 128, 0))
+    while True:
+        if serial.in_waiting:
+            for msg_type, data in decoder.feed(serial.read(serial.in_waiting)):
+                if msg_type == cpm_link.MSG_CONSOLE:
+                    screen.write(data.decode())
+                elif msg_type == cpm_link.MSG_LED:
+                    for led, value in enumerate(cpm_link.unpack_leds(data)):
+                        led_driver.set_gs_led_data(led, value)
+                    led_driver.program()
+
+        while supervisor.runtime.serial_bytes_available:
+            encoder.add(cpm_link.MSG_KEY, sys.stdin.read(1).encode())
+        for frame in encoder.frames():
+            serial.write(frame)
+
+# usb_cdc.data is only present when boot.py enabled it
+if usb_cdc.data is not None:
+    bridge(usb_cdc.data)
+else:
+    led_sweep()
\ No newline at end of file
@@ -0,0 +1,132 @@
+# Framed, batched link between the KB2040 and a host running cpm_core.
+# Both sides import this file, so it sticks to what CircuitPython supports.
+import struct
+
+SYNC = b'\xC5\x4D'
+FRAME_HEADER = '<BH' # sequence, payload length, after the sync bytes
+FRAME_HEADER_SIZE = 5
+MSG_HEADER = '<BH' # type, data length
+MSG_HEADER_SIZE = 3
+CHECKSUM_SIZE = 2
+MAX_PAYLOAD = 1024
+
+MSG_CONSOLE = 1 # host -> board, text for the screen
+MSG_LED = 2 # host -> board, 16 x 12 bit grayscale values
+MSG_KEY = 3 # board -> host, key presses
+
+LED_CHANNELS = 16
+
+
+def checksum(data):
+    return sum(data) & 0xFFFF
+
+
+def pack_leds(values):
+    if len(values) != LED_CHANNELS:
+        raise ValueError("Data must be 16 values long")
+    return struct.pack('<16H', *[value & 0xFFF for value in values])
+
+
+def unpack_leds(data):
+    return struct.unpack('<16H', data)
+
+
+class FrameEncoder:
+    """
+    Collects messages until flushed as one frame. Consecutive console and
+    key messages are joined, and only the newest LED state is kept.
+    """
+    def __init__(self, max_payload=MAX_PAYLOAD):
+        self._max_payload = max_payload
+        self._messages = []
+        self._size = 0
+        self._sequence = 0
+
+    def add(self, msg_type, data):
+        if msg_type == MSG_LED:
+            for message in self._messages:
+                if message[0] == MSG_LED:
+                    self._size += len(data) - len(message[1])
+                    message[1] = bytearray(data)
+                    return
+        elif self._messages and self._messages[-1][0] == msg_type:
+            self._messages[-1][1].extend(data)
+            self._size += len(data)
+            return
+
+        self._messages.append([msg_type, bytearray(data)])
+        self._size += MSG_HEADER_SIZE + len(data)
+
+    def pending(self):
+        return self._size
+
+    def _frame(self, payload):
+        header = SYNC + struct.pack(FRAME_HEADER, self._sequence, len(payload))
+        self._sequence = (self._sequence + 1) & 0xFF
+        return header + bytes(payload) + struct.pack('<H', checksum(payload))
+
+    def frames(self):
+        frames = []
+        payload = bytearray()
+        room = self._max_payload - MSG_HEADER_SIZE
+        for msg_type, data in self._messages:
+            for start in range(0, len(data), room):
+                chunk = data[start:start + room]
+                if len(payload) + MSG_HEADER_SIZE + len(chunk) > self._max_payload:
+                    frames.append(self._frame(payload))
+                    payload = bytearray()
+                payload.extend(struct.pack(MSG_HEADER, msg_type, len(chunk)))
+                payload.extend(chunk)
+        if payload:
+            frames.append(self._frame(payload))
+
+        self._messages = []
+        self._size = 0
+        return frames
+
+
+class FrameDecoder:
+    def __init__(self, max_payload=MAX_PAYLOAD):
+        self._max_payload = max_payload
+        self._buffer = bytearray()
+        self.errors = 0
+
+    def feed(self, data):
+        # returns a list of (type, data) for every complete frame received
+        self._buffer.extend(data)
+        messages = []
+        while True:
+            start = bytes(self._buffer).find(SYNC)
+            if start < 0:
+                # keep a trailing byte in case it starts the next sync
+                self._buffer = self._buffer[-1:]
+                break
+            if start > 0:
+                self._buffer = self._buffer[start:]
+            if len(self._buffer) < FRAME_HEADER_SIZE:
+                break
+
+            _, length = struct.unpack_from(FRAME_HEADER, self._buffer, len(SYNC))
+            if length > self._max_payload:
+                self.errors += 1
+                self._buffer = self._buffer[1:]
+                continue
+            total = FRAME_HEADER_SIZE + length + CHECKSUM_SIZE
+            if len(self._buffer) < total:
+                break
+
+            payload = bytes(self._buffer[FRAME_HEADER_SIZE:FRAME_HEADER_SIZE + length])
+            expected = struct.unpack_from('<H', self._buffer, FRAME_HEADER_SIZE + length)[0]
+            if checksum(payload) != expected:
+                self.errors += 1
+                self._buffer = self._buffer[1:]
+                continue
+
+            self._buffer = self._buffer[total:]
+            offset = 0
+            while offset + MSG_HEADER_SIZE <= len(payload):
+                msg_type, size = struct.unpack_from(MSG_HEADER, payload, offset)
+                offset += MSG_HEADER_SIZE
+                messages.append((msg_type, payload[offset:offset + size]))
+                offset += size
+        return messages
@@ -11,6 +11,8 @@ class CpmScreen:
         self.display.root_group = displayio.Group()
         self._width = width
         self._height = height
+        self._text_area = None
+        self._lines = ['']
 
     def start(self, msg: str):
         color_bitmap = displayio.Bitmap(self._width, self._height, 1)
@@ -27,3 +29,25 @@ class CpmScreen:
 
         text_area = label.Label(terminalio.FONT, text=msg, color=0xFFFFFF, x=28, y=self._height // 2 - 1)
         self.display.root_group.append(text_area)
+        self._text_area = text_area
+
+    def write(self, text: str):
+        # console style output, wraps and scrolls inside the border
+        char_width, char_height = terminalio.FONT.get_bounding_box()
+        columns = (self._width - kBorder * 2) // char_width
+        rows = (self._height - kBorder * 2) // char_height
+        for char in text:
+            if char == '\n':
+                self._lines.append('')
+            elif char == '\x08':
+                self._lines[-1] = self._lines[-1][:-1]
+            elif char >= ' ':
+                if len(self._lines[-1]) >= columns:
+                    self._lines.append('')
+                self._lines[-1] += char
+        self._lines = self._lines[-rows:]
+
+        if self._text_area is not None:
+            self._text_area.anchor_point = (0, 0)
+            self._text_area.anchored_position = (kBorder + 1, kBorder)
+            self._text_area.text = '\n'.join(self._lines)
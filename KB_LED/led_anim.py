@@ -0,0 +1,28 @@
+# Pre-packed TLC5940 animation stream, written by led_compile.py on the host
+# and played back by TLC5940.play. Kept free of host-only imports.
+import struct
+
+MAGIC = b'TLCA'
+VERSION = 1
+CHANNELS = 16
+FRAME_SIZE = 24 # 16 x 12 bit grayscale values
+HEADER = '<4sBBHIH' # magic, version, channels, fps, frame count, frame size
+HEADER_SIZE = 14
+MAX_FPS = 0xFFFF
+
+
+def pack_header(fps, frame_count):
+    if not 1 <= fps <= MAX_FPS:
+        raise ValueError("fps must be between 1 and %d" % MAX_FPS)
+    return struct.pack(HEADER, MAGIC, VERSION, CHANNELS, fps, frame_count, FRAME_SIZE)
+
+
+def unpack_header(data):
+    magic, version, channels, fps, frame_count, frame_size = struct.unpack_from(HEADER, data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a TLC5940 animation")
+    if channels != CHANNELS or frame_size != FRAME_SIZE:
+        raise ValueError("Unsupported frame layout")
+    if not fps:
+        raise ValueError("Invalid frame rate")
+    return fps, frame_count
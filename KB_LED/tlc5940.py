@@ -2,6 +2,9 @@ from adafruit_bus_device import spi_device
 import digitalio
 import busio
 import pwmio
+import time
+
+import led_anim
 
 try:
     import typing
@@ -92,9 +95,11 @@ class TLC5940:
         self._gs_led_data[index] = value
 
     def program(self):
-        gs_data = gs_data_to_bytes(self._gs_led_data)
-        dc_data = dc_data_to_bytes(self._dc_led_data)
+        self.program_gs(gs_data_to_bytes(self._gs_led_data))
+        self.program_dc()
 
+    def program_gs(self, gs_data):
+        # gs_data is 24 packed bytes, any buffer spi.write accepts
         self._vprg.value = False # GS mode
         with self._device:
             self._spi.write(gs_data)
@@ -103,6 +108,8 @@ class TLC5940:
         self._xlat.value = True
         self._xlat.value = False
 
+    def program_dc(self):
+        dc_data = dc_data_to_bytes(self._dc_led_data)
         self._vprg.value = True # DC mode
         # need 96 bits (12 bytes)
         # dc_led_data = 4*[0b011111] + 4*[0b001111] + 4*[0b000111] + 4*[0b000011]
@@ -113,9 +120,38 @@ class TLC5940:
         self._xlat.value = True
         self._xlat.value = False
 
+    def play(self, stream, fps=None, loop=False, chunk_frames=32):
+        # stream is a file opened 'rb' on a led_compile.py output
+        header = bytearray(led_anim.HEADER_SIZE)
+        stream.readinto(header)
+        file_fps, frame_count = led_anim.unpack_header(header)
+        period = 1_000_000_000 // (fps or file_fps)
+
+        self.program_dc()
+        buffer = bytearray(led_anim.FRAME_SIZE * chunk_frames)
+        view = memoryview(buffer)
+        next_frame = time.monotonic_ns()
+        while True:
+            remaining = frame_count
+            while remaining:
+                count = stream.readinto(view[:led_anim.FRAME_SIZE * min(remaining, chunk_frames)])
+                frames = count // led_anim.FRAME_SIZE
+                if not frames:
+                    return
+                for index in range(frames):
+                    start = index * led_anim.FRAME_SIZE
+                    self.program_gs(view[start:start + led_anim.FRAME_SIZE])
+                    next_frame += period
+                    delay = next_frame - time.monotonic_ns()
+                    if delay > 0:
+                        time.sleep(delay / 1_000_000_000)
+                remaining -= frames
+            if not loop:
+                return
+            stream.seek(led_anim.HEADER_SIZE)
+
 if __name__ == "__main__":
     import board
-    import time
 
     spi = busio.SPI(board.SCK, MISO=board.MISO, MOSI=board.MOSI)
     led_driver = TLC5940(spi,
@@ -32,7 +32,7 @@ class Bios:
         self._error_message = msg
 
     def print_error(self):
-        msg = self._state._error_message
+        msg = self._state.error_message
         if msg is not None:
             self.print(msg)
         else:
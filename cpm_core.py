@@ -1,12 +1,17 @@
 from __future__ import annotations
+import abc
 import asyncio
 import ast
+import os
+import mmap
 import sys
 import time
-import inspect
+import json
+import bisect
 import dataclasses
 import enum
-from typing import List, Optional, Iterable, Union
+import collections
+from typing import List, Optional, Iterable, Iterator, Union, Dict, Set, Tuple, Callable, Awaitable
 
 async def blink(pin, count):
     index = 0
@@ -15,8 +20,7 @@ async def blink(pin, count):
         index += 1
         await asyncio.sleep(1)
 
-    frame = inspect.currentframe()
-    print(f"Done: {frame.f_code.co_name}, {inspect.getargvalues(frame)}")
+    print(f"Done: blink({pin=}, {count=})")
 
 """
 Drives: 16  (A - P)
@@ -93,12 +97,37 @@ class User(enum.Enum):
 
 class BdosOpcode(enum.Enum):
     SEARCH = 'search'
+    SEARCH_NEXT = 'search_next'
     OPEN = 'open'
     CLOSE = 'close'
+    MAKE = 'make'
+    DELETE = 'delete'
     RENAME = 'rename'
     READ = 'read'
     WRITE = 'write'
+    READ_RANDOM = 'read_random'
+    WRITE_RANDOM = 'write_random'
+    SET_DMA = 'set_dma'
     SELECT = 'select'
+    READ_FILE = 'read_file'
+    LOCK_RECORD = 'lock_record'
+    UNLOCK_RECORD = 'unlock_record'
+
+
+class BdosReturn(enum.IntEnum):
+    # values are shared between calls, so some names alias each other
+    OK = 0x00
+    EOF = 0x01
+    NO_DATA = 0x01
+    DIRECTORY_FULL = 0x01
+    DISK_FULL = 0x02
+    NO_EXTENT = 0x04
+    OUT_OF_RANGE = 0x06
+    # MP/M extensions for shared drives
+    FILE_IN_USE = 0x05
+    RECORD_LOCKED = 0x08
+    LOCK_LIMIT = 0x0C
+    ERROR = 0xFF
 
 
 @dataclasses.dataclass
@@ -150,6 +179,7 @@ class CcpOpcode(enum.Enum):
     EXIT = 'exit' 
     PY = 'py'
     ERR = 'err' # print current logged error strign 
+    STATS = 'stats' # stats [on|off|reset|json <path>]
 
     def __str__(self):
         return str(self.value)
@@ -162,6 +192,9 @@ class CcpOpcode(enum.Enum):
         else:
             return False
 
+    def __hash__(self) -> int:
+        return hash(str(self))
+
 
 class CcpCommand:
     DELIM = ' '
@@ -180,6 +213,11 @@ class CcpCommand:
     def as_message(self) -> CcpMessage:
         return CcpMessage(self._raw_value)
 
+    @property
+    def args(self) -> str:
+        symbols = self._raw_value.split(CcpCommand.DELIM, 1)
+        return symbols[1].strip() if len(symbols) > 1 else ''
+
 
     def is_quit(self) -> bool:
         return self._opcode == CcpOpcode.EXIT
@@ -199,6 +237,192 @@ class CcpCommand:
 
 class BiosWriteDest(enum.Enum):
     DISPLAY = enum.auto()
+    LIST = enum.auto()
+    PUNCH = enum.auto()
+
+    @property
+    def device_name(self) -> str:
+        return self.name.lower()
+
+READER_DEVICE = 'reader'
+
+MEMORY_SIZE = 0x10000
+DEFAULT_FCB = 0x005C
+DEFAULT_DMA = 0x0080
+TPA_START = 0x0100
+PAGE_SIZE = 256
+
+class Histogram:
+    # bucket upper bounds in microseconds, last bucket is everything slower
+    BOUNDS_US = (10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000, 500000, 1000000)
+
+    def __init__(self):
+        self.buckets = [0] * (len(Histogram.BOUNDS_US) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self.buckets[bisect.bisect_left(Histogram.BOUNDS_US, seconds * 1e6)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'total_us': round(self.total * 1e6),
+            'max_us': round(self.max * 1e6),
+            'buckets_us': dict(zip([str(bound) for bound in Histogram.BOUNDS_US] + ['inf'], self.buckets)),
+        }
+
+    def __str__(self) -> str:
+        average = self.total / self.count if self.count else 0.0
+        return f'n={self.count} avg={average * 1e6:.0f}us max={self.max * 1e6:.0f}us'
+
+class Stats:
+    """
+    Opt in timing for CCP commands, BDOS calls and BIOS output.
+
+    Every hook checks `enabled` before touching the clock, so a disabled
+    instance costs one attribute lookup per call. Cache and byte counters
+    are plain integers kept by the disks and are read at snapshot time.
+    """
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        self.commands: Dict[str, Histogram] = collections.defaultdict(Histogram)
+        self.bdos: Dict[str, Histogram] = collections.defaultdict(Histogram)
+        self.bios: Dict[str, Histogram] = collections.defaultdict(Histogram)
+
+    def record_command(self, name: str, seconds: float):
+        self.commands[name].add(seconds)
+
+    def record_bdos(self, opcode: BdosOpcode, seconds: float):
+        self.bdos[opcode.value].add(seconds)
+
+    def record_bios(self, name: str, seconds: float):
+        self.bios[name].add(seconds)
+
+    def snapshot(self, bdos: Optional[Bdos] = None) -> dict:
+        result = {
+            'enabled': self.enabled,
+            'commands': {name: value.to_dict() for name, value in self.commands.items()},
+            'bdos': {name: value.to_dict() for name, value in self.bdos.items()},
+            'bios': {name: value.to_dict() for name, value in self.bios.items()},
+            'drives': {},
+        }
+        if bdos is not None:
+            for drive, disk in bdos.disks():
+                result['drives'][str(drive)] = disk.stats()
+            result['locks'] = bdos.locks.stats()
+        return result
+
+    def to_json(self, bdos: Optional[Bdos] = None) -> str:
+        return json.dumps(self.snapshot(bdos), indent=2)
+
+    def as_message(self, bdos: Optional[Bdos] = None) -> CcpMessage:
+        msg = CcpMessage(auto_lock=False)
+        msg.append(f'Stats {"on" if self.enabled else "off"}')
+        for title, table in (('CMD', self.commands), ('BDOS', self.bdos), ('BIOS', self.bios)):
+            for name, value in sorted(table.items()):
+                msg.append(f'{title:<4} {name:<12} {value}')
+        if bdos is not None:
+            for drive, disk in bdos.disks():
+                values = disk.stats()
+                line = f'{drive}: read {values.get("bytes_read", 0)}B written {values.get("bytes_written", 0)}B'
+                lookups = values.get('cache_hits', 0) + values.get('cache_misses', 0)
+                if lookups:
+                    line += f' cache {100 * values["cache_hits"] / lookups:.0f}% hit'
+                msg.append(line)
+        msg.lock()
+        return msg
+
+class EventKind(enum.Enum):
+    ERROR = 'error'
+    EVENT = 'event'
+
+    def __str__(self):
+        return str(self.value)
+
+class EventRecord:
+    __slots__ = ('seq', 'timestamp', 'kind', 'source', 'message')
+
+    def __init__(self):
+        self.seq = -1
+        self.timestamp = 0.0
+        self.kind = EventKind.EVENT
+        self.source = ''
+        self.message: Optional[CcpMessage] = None
+
+    def to_dict(self) -> dict:
+        return {
+            'seq': self.seq,
+            'timestamp': self.timestamp,
+            'kind': str(self.kind),
+            'source': self.source,
+            'message': list(self.message.entries) if self.message is not None else [],
+        }
+
+class EventLog:
+    """
+    Fixed size ring of error and event records for one session.
+
+    Records are allocated up front and overwritten in place, so logging
+    never allocates and history never grows past the capacity.
+    """
+    def __init__(self, capacity: int = 128):
+        self._records = [EventRecord() for _ in range(capacity)]
+        self._capacity = capacity
+        self._count = 0
+
+    def __len__(self) -> int:
+        return min(self._count, self._capacity)
+
+    @property
+    def total(self) -> int:
+        # including records that have been overwritten
+        return self._count
+
+    def log(self, kind: EventKind, source: str, message: CcpMessage):
+        record = self._records[self._count % self._capacity]
+        record.seq = self._count
+        record.timestamp = time.time()
+        record.kind = kind
+        record.source = source
+        record.message = message
+        self._count += 1
+
+    def records(self, kind: Optional[EventKind] = None) -> Iterator[EventRecord]:
+        # newest first
+        for seq in range(self._count - 1, self._count - 1 - len(self), -1):
+            record = self._records[seq % self._capacity]
+            if kind is None or record.kind == kind:
+                yield record
+
+    def last(self, kind: Optional[EventKind] = None) -> Optional[EventRecord]:
+        return next(self.records(kind), None)
+
+    def recent(self, count: int, kind: Optional[EventKind] = None) -> List[EventRecord]:
+        result = []
+        for record in self.records(kind):
+            if len(result) >= count:
+                break
+            result.append(record)
+        return result
+
+    def export(self) -> List[dict]:
+        # oldest first
+        return [record.to_dict() for record in reversed(list(self.records()))]
+
+    def to_json(self) -> str:
+        return json.dumps(self.export(), indent=2)
+
+    def clear(self):
+        self._count = 0
 
 @dataclasses.dataclass
 class CpmState:
@@ -206,44 +430,289 @@ class CpmState:
     version: CpmVersion
     user: User
     prompt: str = ">"
-    error_message: Optional[CcpMessage] = None
+    events: EventLog = dataclasses.field(default_factory=EventLog)
+    stats: Stats = dataclasses.field(default_factory=Stats)
+    memory: bytearray = dataclasses.field(default_factory=lambda: bytearray(MEMORY_SIZE))
+
+    @property
+    def error_message(self) -> Optional[CcpMessage]:
+        record = self.events.last(EventKind.ERROR)
+        return None if record is None else record.message
+
+    def log_error(self, msg: Optional[CcpMessage], source: str = 'ccp'):
+        if msg is not None:
+            self.events.log(EventKind.ERROR, source, msg)
+
+    def log_event(self, msg: CcpMessage, source: str = 'ccp'):
+        self.events.log(EventKind.EVENT, source, msg)
+
+class DeviceOverflow(enum.Enum):
+    BLOCK = enum.auto() # put() waits for room, offer() drops the new item
+    DROP_NEWEST = enum.auto()
+    DROP_OLDEST = enum.auto() # for state where only the latest value matters, e.g. LEDs
+
+class BiosDevice:
+    """
+    Peripheral driven from its own task through a bounded queue.
+
+    Writers await put(), which applies backpressure by default: a writer
+    that gets ahead of the device waits for room instead of losing output.
+    A device that makes no progress for put_timeout seconds is marked
+    stalled and drops output until it handles an item again, so a hung
+    peripheral can slow the CCP down but never block it.
+    Lossy policies are for devices where only the latest state matters.
+    Subclasses implement handle() for output and call feed() for input.
+    """
+    def __init__(self, name: str, maxsize: int = 64, overflow: DeviceOverflow = DeviceOverflow.BLOCK,
+                 put_timeout: Optional[float] = 1.0):
+        self.name = name
+        self.overflow = overflow
+        self.put_timeout = put_timeout
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self._inbound: asyncio.Queue = asyncio.Queue(maxsize)
+        self.stalled = False
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+
+    async def handle(self, item):
+        pass
+
+    def offer(self, item) -> bool:
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        if self.overflow != DeviceOverflow.DROP_OLDEST:
+            self.dropped += 1
+            return False
+
+        self._queue.get_nowait()
+        self._queue.task_done()
+        self._queue.put_nowait(item)
+        self.dropped += 1
+        return True
+
+    async def put(self, item) -> bool:
+        if self.overflow != DeviceOverflow.BLOCK or self.stalled:
+            return self.offer(item)
+        try:
+            await asyncio.wait_for(self._queue.put(item), self.put_timeout)
+            return True
+        except asyncio.TimeoutError:
+            self.stalled = True
+            self.dropped += 1
+            return False
+
+    def feed(self, item) -> bool:
+        # input from the device side, e.g. a paper tape reader
+        try:
+            self._inbound.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+
+    async def read(self):
+        return await self._inbound.get()
 
-    def log_error(self, msg: Optional[CcpMessage]):
-        self.error_message = msg
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    async def drain(self, timeout: Optional[float] = None) -> bool:
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def run(self):
+        while True:
+            item = await self._queue.get()
+            try:
+                await self.handle(item)
+                self.written += 1
+            except Exception:
+                self.errors += 1
+            finally:
+                self._queue.task_done()
+            self.stalled = False
+
+class CallbackDevice(BiosDevice):
+    # wraps a blocking write, such as an I2C display, and runs it off the event loop
+    def __init__(self, name: str, write: Callable[[object], None], threaded: bool = True, **kwargs):
+        super().__init__(name, **kwargs)
+        self._write_fn = write
+        self._threaded = threaded
+
+    async def handle(self, item):
+        if self._threaded:
+            await asyncio.to_thread(self._write_fn, item)
+        else:
+            self._write_fn(item)
+
+class DeviceBus:
+    def __init__(self):
+        self._devices: Dict[str, BiosDevice] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._running = False
+
+    def register(self, device: BiosDevice):
+        self.unregister(device.name)
+        self._devices[device.name] = device
+        if self._running:
+            self._tasks[device.name] = asyncio.create_task(device.run())
+
+    def unregister(self, name: str) -> Optional[BiosDevice]:
+        task = self._tasks.pop(name, None)
+        if task is not None:
+            task.cancel()
+        return self._devices.pop(name, None)
+
+    def device(self, name: str) -> Optional[BiosDevice]:
+        return self._devices.get(name)
+
+    def devices(self) -> List[BiosDevice]:
+        return list(self._devices.values())
+
+    def start(self):
+        # needs a running loop
+        self._running = True
+        for name, device in self._devices.items():
+            if name not in self._tasks:
+                self._tasks[name] = asyncio.create_task(device.run())
+
+    async def stop(self, drain: bool = True, timeout: float = 1.0):
+        # drain only on a clean shutdown, a hung device gets timeout seconds at most
+        if drain:
+            for name, device in self._devices.items():
+                if name in self._tasks and not device.stalled:
+                    await device.drain(timeout)
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._tasks.clear()
+        self._running = False
+
+    def offer(self, name: str, item) -> bool:
+        device = self._devices.get(name)
+        return device is not None and device.offer(item)
+
+    async def put(self, name: str, item) -> bool:
+        device = self._devices.get(name)
+        if device is None:
+            return False
+        if name not in self._tasks:
+            # nothing drains a device that is not running, waiting would hang
+            return device.offer(item)
+        return await device.put(item)
 
 class Bios:
     def __init__(self, state: CpmState):
-        self._printer = print
+        self._printer: Optional[Callable[[str], None]] = Bios._write_console
+        self._reader: Callable[[str], Awaitable[str]] = Bios._read_console
+        # True while the CCP waits for a command, False for a built-in's prompt
+        self.reading_command = False
         self._state = state
-        self._error_message: Optional[CcpMessage] = None
+        self.devices = DeviceBus()
+
+    async def _write(self, message: CcpMessage, dest: BiosWriteDest, dest_info = None):
+        # the console is mirrored to a 'display' device when one is registered
+        name = dest.device_name if dest_info is None else dest_info
+        for entry in message.entries:
+            if dest == BiosWriteDest.DISPLAY and self._printer is not None:
+                self._printer(f'{entry}\n')
+            await self.devices.put(name, f'{entry}\n')
+
+    async def write(self, message: CcpMessage, dest: BiosWriteDest, dest_info: Optional[str] = None):
+        # LST:, PUN: or a user defined device named by dest_info
+        if not message.is_empty():
+            await self._write(message=message, dest=dest, dest_info=dest_info)
 
-    def _write(self, message: CcpMessage, dest: BiosWriteDest, dest_info = None):
-        if dest == BiosWriteDest.DISPLAY:
-            for entry in message.entries:
-                self._printer(f'{entry}')
+    async def read_reader(self):
+        device = self.devices.device(READER_DEVICE)
+        return None if device is None else await device.read()
 
-    def print(self, message: CcpMessage):
-        if not message.is_empty():
-            self._write(message=message, dest=BiosWriteDest.DISPLAY)
+    async def print(self, message: CcpMessage):
+        if message.is_empty():
+            return
+        if not self._state.stats.enabled:
+            await self._write(message=message, dest=BiosWriteDest.DISPLAY)
+            return
+
+        start = time.perf_counter()
+        await self._write(message=message, dest=BiosWriteDest.DISPLAY)
+        self._state.stats.record_bios('print', time.perf_counter() - start)
+
+    async def stream(self, chunks: Iterable[bytes]):
+        if not self._state.stats.enabled:
+            await self._stream(chunks)
+            return
+
+        start = time.perf_counter()
+        await self._stream(chunks)
+        self._state.stats.record_bios('stream', time.perf_counter() - start)
+
+    async def _stream(self, chunks: Iterable[bytes]):
+        # write text a block at a time, stopping at the first ^Z
+        last = '\n'
+        for chunk in chunks:
+            end = chunk.find(EOF_BYTE)
+            text = (chunk if end < 0 else chunk[:end]).decode('latin-1').replace('\r', '')
+            if text:
+                if self._printer is not None:
+                    self._printer(text)
+                await self.devices.put(BiosWriteDest.DISPLAY.device_name, text)
+                last = text[-1]
+            if end >= 0:
+                break
+            # let device tasks drain between blocks
+            await asyncio.sleep(0)
+        if last != '\n' and self._printer is not None:
+            self._printer('\n')
 
     def set_error_message(self, msg: CcpMessage):
-        self._error_message = msg
+        self._state.log_error(msg, source='bios')
 
-    def print_error(self):
-        msg = self._state._error_message
+    async def print_error(self):
+        msg = self._state.error_message
         if msg is not None:
-            self.print(msg)
+            await self.print(msg)
         else:
-            self.print(CcpMessage('No error logged.'))
+            await self.print(CcpMessage('No error logged.'))
     
     async def get_input(self) -> CcpCommand:
         # prefix = f'{self._state.drive}{self._state.user}{self._state.prompt}'
         # await asyncio.to_thread(sys.stdout.write, prefix)
         # value = await asyncio.to_thread(sys.stdin.readline)
         prefix = f'{self._state.drive}{self._state.user}{self._state.prompt}'
-        value = await asyncio.to_thread(input, prefix)
+        self.reading_command = True
+        value = await self._reader(prefix)
         return CcpCommand(raw_value=value.strip())
 
+    async def get_line(self, prompt: str = '') -> str:
+        self.reading_command = False
+        value = await self._reader(prompt)
+        return value.strip()
+
+    def set_reader(self, reader: Callable[[str], Awaitable[str]]):
+        # swap the console for a recorder or replayer
+        self._reader = reader
+
+    def set_printer(self, printer: Optional[Callable[[str], None]]):
+        # all local console text, None silences it; devices still get their copy
+        self._printer = printer
+
+    @staticmethod
+    def _write_console(text: str):
+        sys.stdout.write(text)
+
+    @staticmethod
+    async def _read_console(prompt: str) -> str:
+        return await asyncio.to_thread(input, prompt)
+
 
 
 class FileSpec:
@@ -261,8 +730,9 @@ class FileSpec:
         self._drive = drive
         self._user = user
 
-        self._filename_is_afn = any(char in FileSpec.WILDCARD_SINGLE for char in self._filename)
-        self._ext_is_afn = any(char in FileSpec.WILDCARD_SINGLE for char in self._extension)
+        wildcards = FileSpec.WILDCARD_SINGLE | FileSpec.WILDCARD_ALL
+        self._filename_is_afn = any(char in wildcards for char in self._filename)
+        self._ext_is_afn = any(char in wildcards for char in self._extension)
         self._is_afn = self._filename_is_afn or self._ext_is_afn
 
     def is_afn(self) -> bool:
@@ -271,6 +741,27 @@ class FileSpec:
     def is_ufn(self) -> bool:
         return not self.is_afn()
 
+    def is_valid(self, allow_empty: bool = False) -> bool:
+        # DIR may leave the name out entirely, nothing else may
+        if not self._filename and (self._extension or not allow_empty):
+            return False
+        invalid = FileSpec.RESERVED_CHARS | FileSpec.DRIVE_SUFFIX | FileSpec.DELIM
+        return all(char.isascii() and char.isprintable() and not char.isspace() and char not in invalid
+                   for char in self._filename + self._extension)
+
+    @staticmethod
+    def _expand(value: str, width: int) -> str:
+        for index, char in enumerate(value):
+            if char in FileSpec.WILDCARD_ALL:
+                value = value[:index] + '?' * (width - index)
+                break
+        return value.upper()[:width].ljust(width)
+
+    def pattern(self) -> bytes:
+        # 11 byte directory form, '*' expanded to '?' and space padded
+        name = FileSpec._expand(self._filename, 8) + FileSpec._expand(self._extension, 3)
+        return name.encode('ascii')
+
     def __str__(self) -> str:
         return f'{self._drive}{self._user}:{self._filename}.{self._extension}'
 
@@ -372,9 +863,1559 @@ class FileSpec:
         else:
             return FileSpec(filename=raw_filename, extension=raw_ext, drive=drive, user=state.user)
 
+RECORD_SIZE = 128
+RECORDS_PER_EXTENT = 128
+DIR_ENTRY_SIZE = 32
+EMPTY_BYTE = 0xE5
+EOF_BYTE = 0x1A
+WILDCARD_BYTE = ord('?')
+
+
+@dataclasses.dataclass(frozen=True)
+class DiskParameterBlock:
+    spt: int # 128 byte records per track
+    bsh: int # block shift
+    blm: int # block mask
+    exm: int # extent mask
+    dsm: int # highest block number
+    drm: int # highest directory entry
+    al0: int
+    al1: int
+    cks: int
+    off: int # reserved tracks
+
+    @property
+    def records_per_block(self) -> int:
+        return self.blm + 1
+
+    @property
+    def block_size(self) -> int:
+        return RECORD_SIZE << self.bsh
+
+    @property
+    def block_count(self) -> int:
+        return self.dsm + 1
+
+    @property
+    def dir_entries(self) -> int:
+        return self.drm + 1
+
+    @property
+    def wide_blocks(self) -> bool:
+        return self.dsm > 0xFF
+
+    @property
+    def blocks_per_entry(self) -> int:
+        return 8 if self.wide_blocks else 16
+
+    @property
+    def records_per_entry(self) -> int:
+        return RECORDS_PER_EXTENT * (self.exm + 1)
+
+    @property
+    def directory_blocks(self) -> List[int]:
+        mask = (self.al0 << 8) | self.al1
+        return [index for index in range(16) if mask & (0x8000 >> index)]
+
+    @property
+    def total_records(self) -> int:
+        return self.off * self.spt + self.block_count * self.records_per_block
+
+    def block_to_record(self, block: int) -> int:
+        return self.off * self.spt + block * self.records_per_block
+
+
+# 8" single sided, single density
+DPB_IBM_3740 = DiskParameterBlock(spt=26, bsh=3, blm=7, exm=0, dsm=242, drm=63,
+                                  al0=0xC0, al1=0x00, cks=16, off=2)
+# RunCPM style 8MB drive
+DPB_HD_8MB = DiskParameterBlock(spt=64, bsh=5, blm=31, exm=1, dsm=2047, drm=511,
+                                al0=0xF0, al1=0x00, cks=0, off=0)
+
+
+def name_matches(pattern: bytes, name: bytes) -> bool:
+    # attribute bits (R/O, SYS) live in the high bit of each name byte
+    for want, have in zip(pattern, name):
+        if want != WILDCARD_BYTE and want != (have & 0x7F):
+            return False
+    return True
+
+
+class DiskImage(abc.ABC):
+    """Record addressed backing store for a drive."""
+    def __init__(self, dpb: DiskParameterBlock):
+        self.dpb = dpb
+        self.read_ops = 0
+        self.write_ops = 0
+
+    @abc.abstractmethod
+    def read_records(self, record: int, count: int) -> bytes:
+        pass
+
+    @abc.abstractmethod
+    def write_records(self, record: int, data: bytes):
+        pass
+
+    def read_into(self, record: int, dest: memoryview):
+        dest[:] = self.read_records(record, len(dest) // RECORD_SIZE)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class MemoryDiskImage(DiskImage):
+    def __init__(self, dpb: DiskParameterBlock, data: Optional[bytearray] = None):
+        super().__init__(dpb)
+        if data is None:
+            data = bytearray([EMPTY_BYTE]) * (dpb.total_records * RECORD_SIZE)
+        self._data = data
+
+    def read_records(self, record: int, count: int) -> bytes:
+        self.read_ops += 1
+        start = record * RECORD_SIZE
+        return bytes(self._data[start:start + count * RECORD_SIZE])
+
+    def read_into(self, record: int, dest: memoryview):
+        self.read_ops += 1
+        start = record * RECORD_SIZE
+        dest[:] = memoryview(self._data)[start:start + len(dest)]
+
+    def write_records(self, record: int, data: bytes):
+        self.write_ops += 1
+        start = record * RECORD_SIZE
+        self._data[start:start + len(data)] = data
+
+
+class FileDiskImage(DiskImage):
+    def __init__(self, path: str, dpb: DiskParameterBlock, create: bool = False):
+        super().__init__(dpb)
+        self.path = path
+        if create:
+            with open(path, 'wb') as file:
+                file.write(bytes([EMPTY_BYTE]) * (dpb.total_records * RECORD_SIZE))
+        self._file = open(path, 'r+b')
+
+    def read_records(self, record: int, count: int) -> bytes:
+        self.read_ops += 1
+        size = count * RECORD_SIZE
+        self._file.seek(record * RECORD_SIZE)
+        data = self._file.read(size)
+        if len(data) < size:
+            # past the end of a short image reads as unformatted
+            data += bytes([EMPTY_BYTE]) * (size - len(data))
+        return data
+
+    def read_into(self, record: int, dest: memoryview):
+        self.read_ops += 1
+        self._file.seek(record * RECORD_SIZE)
+        count = self._file.readinto(dest)
+        if count < len(dest):
+            dest[count:] = bytes([EMPTY_BYTE]) * (len(dest) - count)
+
+    def write_records(self, record: int, data: bytes):
+        self.write_ops += 1
+        self._file.seek(record * RECORD_SIZE)
+        self._file.write(data)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+class SharedBaseImage:
+    """
+    Read only, memory mapped disk image shared by every overlay in the process.
+    Use SharedBaseImage.get so each path is only mapped once.
+
+    The file must be in logical record order. Images of skewed formats are
+    stored in physical order; write them with cpm_image.py convert --logical.
+    """
+    _instances: Dict[str, SharedBaseImage] = {}
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.users = 0
+
+    @classmethod
+    def get(cls, path: str) -> SharedBaseImage:
+        path = os.path.abspath(path)
+        base = cls._instances.get(path)
+        if base is None:
+            base = cls(path)
+            cls._instances[path] = base
+        return base
+
+    def __len__(self) -> int:
+        return len(self._map)
+
+    def read(self, start: int, size: int) -> bytes:
+        data = self._map[start:start + size]
+        if len(data) < size:
+            data += bytes([EMPTY_BYTE]) * (size - len(data))
+        return data
+
+    def read_into(self, start: int, dest: memoryview):
+        # straight from the mapping into dest, no intermediate bytes
+        size = max(0, min(len(dest), len(self._map) - start))
+        with memoryview(self._map) as view:
+            dest[:size] = view[start:start + size]
+        if size < len(dest):
+            dest[size:] = bytes([EMPTY_BYTE]) * (len(dest) - size)
+
+    def release(self):
+        self.users -= 1
+        if self.users <= 0:
+            SharedBaseImage._instances.pop(self.path, None)
+            self._map.close()
+            self._file.close()
+
+
+class OverlayDiskImage(DiskImage):
+    """
+    Copy on write view of a shared base image.
+
+    Reads fall through to the base unless the record has been written in this
+    overlay; written records live in a sparse per session map, so memory use
+    tracks what the session writes rather than the size of the drive.
+    Snapshots are cheap because stored records are immutable bytes.
+
+    The CpmDisk on top holds a directory index, so remount it after restore()
+    or discard().
+    """
+    def __init__(self, base: Union[str, SharedBaseImage], dpb: DiskParameterBlock):
+        super().__init__(dpb)
+        self.base = SharedBaseImage.get(base) if isinstance(base, str) else base
+        self.base.users += 1
+        self._records: Dict[int, bytes] = {}
+
+    @property
+    def overlay_records(self) -> int:
+        return len(self._records)
+
+    def read_records(self, record: int, count: int) -> bytes:
+        self.read_ops += 1
+        data = self.base.read(record * RECORD_SIZE, count * RECORD_SIZE)
+        if not self._records:
+            return data
+
+        result = None
+        for index in range(count):
+            written = self._records.get(record + index)
+            if written is None:
+                continue
+            if result is None:
+                result = bytearray(data)
+            start = index * RECORD_SIZE
+            result[start:start + RECORD_SIZE] = written
+        return data if result is None else bytes(result)
+
+    def read_into(self, record: int, dest: memoryview):
+        self.read_ops += 1
+        self.base.read_into(record * RECORD_SIZE, dest)
+        if not self._records:
+            return
+        for index in range(len(dest) // RECORD_SIZE):
+            written = self._records.get(record + index)
+            if written is not None:
+                dest[index * RECORD_SIZE:(index + 1) * RECORD_SIZE] = written
+
+    def write_records(self, record: int, data: bytes):
+        self.write_ops += 1
+        view = memoryview(data)
+        for index in range(len(data) // RECORD_SIZE):
+            chunk = bytes(view[index * RECORD_SIZE:(index + 1) * RECORD_SIZE])
+            if chunk == self.base.read((record + index) * RECORD_SIZE, RECORD_SIZE):
+                # writing back the base contents frees the overlay record
+                self._records.pop(record + index, None)
+            else:
+                self._records[record + index] = chunk
+
+    def snapshot(self) -> Dict[int, bytes]:
+        return dict(self._records)
+
+    def restore(self, snapshot: Dict[int, bytes]):
+        self._records = dict(snapshot)
+
+    def discard(self):
+        self._records = {}
+
+    def close(self):
+        self._records = {}
+        self.base.release()
+
+
+class BlockCache:
+    """
+    Write back cache of allocation blocks.
+
+    Runs of physically consecutive blocks are read in a single backing store
+    operation, and dirty blocks are written back with consecutive blocks
+    coalesced into one write.
+    """
+    def __init__(self, image: DiskImage, capacity: int = 64, max_dirty: int = 16):
+        self._image = image
+        self._dpb = image.dpb
+        self._capacity = capacity
+        self._max_dirty = max_dirty
+        # blocks are views, so records can be copied to and from TPA memory
+        # with slice assignment and no intermediate bytes objects
+        self._blocks: collections.OrderedDict[int, memoryview] = collections.OrderedDict()
+        self._dirty: Set[int] = set()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def get(self, block: int) -> Optional[memoryview]:
+        buffer = self._blocks.get(block)
+        if buffer is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._blocks.move_to_end(block)
+        return buffer
+
+    def load(self, first: int, count: int = 1) -> memoryview:
+        # caller guarantees blocks first .. first + count - 1 are not cached
+        size = self._dpb.block_size
+        data = memoryview(bytearray(count * size))
+        self._image.read_into(self._dpb.block_to_record(first), data)
+        self.bytes_read += len(data)
+        for index in range(count):
+            self._insert(first + index, data[index * size:(index + 1) * size])
+        return self._blocks[first]
+
+    def new(self, block: int) -> memoryview:
+        buffer = memoryview(bytearray([EMPTY_BYTE]) * self._dpb.block_size)
+        self._insert(block, buffer)
+        return buffer
+
+    def contains(self, block: int) -> bool:
+        return block in self._blocks
+
+    def mark_dirty(self, block: int):
+        self._dirty.add(block)
+        if len(self._dirty) >= self._max_dirty:
+            self.flush()
+
+    def discard(self, block: int):
+        # freed blocks never need writing back
+        self._dirty.discard(block)
+        self._blocks.pop(block, None)
+
+    def _insert(self, block: int, buffer: memoryview):
+        self._blocks[block] = buffer
+        self._blocks.move_to_end(block)
+        while len(self._blocks) > self._capacity:
+            oldest = next(iter(self._blocks))
+            if oldest in self._dirty:
+                self.flush()
+            del self._blocks[oldest]
+
+    def flush(self):
+        if not self._dirty:
+            return
+
+        run: List[int] = []
+        for block in sorted(self._dirty):
+            if run and block != run[-1] + 1:
+                self._write_run(run)
+                run = []
+            run.append(block)
+        self._write_run(run)
+        self._dirty.clear()
+        self._image.flush()
+
+    def _write_run(self, run: List[int]):
+        data = b''.join(self._blocks[block] for block in run)
+        self.bytes_written += len(data)
+        self._image.write_records(self._dpb.block_to_record(run[0]), data)
+
+
+class DirEntry:
+    __slots__ = ('user', 'name', 'extent', 'rc', 'blocks')
+
+    def __init__(self, user: int = EMPTY_BYTE, name: bytes = b' ' * 11, extent: int = 0,
+                 rc: int = 0, blocks: Optional[List[int]] = None):
+        self.user = user
+        self.name = name
+        self.extent = extent # logical extent, s2 * 32 + ex
+        self.rc = rc
+        self.blocks = blocks if blocks is not None else []
+
+    @classmethod
+    def from_bytes(cls, data: bytes, wide: bool) -> DirEntry:
+        if wide:
+            blocks = [data[16 + index] | (data[17 + index] << 8) for index in range(0, 16, 2)]
+        else:
+            blocks = list(data[16:32])
+        return cls(user=data[0], name=bytes(data[1:12]),
+                   extent=((data[14] & 0x3F) << 5) | (data[12] & 0x1F),
+                   rc=data[15], blocks=blocks)
+
+    def to_bytes(self, wide: bool) -> bytes:
+        if self.is_empty():
+            return bytes([EMPTY_BYTE]) * DIR_ENTRY_SIZE
+
+        count = 8 if wide else 16
+        blocks = (self.blocks + [0] * count)[:count]
+        if wide:
+            alloc = b''.join(block.to_bytes(2, 'little') for block in blocks)
+        else:
+            alloc = bytes(blocks)
+        header = bytes([self.user]) + self.name + bytes([self.extent & 0x1F, 0, self.extent >> 5, self.rc])
+        return header + alloc
+
+    def is_empty(self) -> bool:
+        return self.user == EMPTY_BYTE
+
+    @property
+    def key(self) -> bytes:
+        return bytes(char & 0x7F for char in self.name)
+
+    @property
+    def filename(self) -> str:
+        return self.key[:8].decode('ascii', 'replace').rstrip()
+
+    @property
+    def extension(self) -> str:
+        return self.key[8:].decode('ascii', 'replace').rstrip()
+
+    def __str__(self) -> str:
+        return f'{self.filename}.{self.extension}'
+
+
+class OpenMode(enum.Enum):
+    # MP/M open modes, LOCKED is exclusive, the others can be shared with other sessions
+    LOCKED = 'locked'
+    UNLOCKED = 'unlocked'
+    READ_ONLY = 'read_only'
+
+    def __str__(self):
+        return self.value
+
+
+class Fcb:
+    """File control block, 36 bytes as laid out in CP/M 2.2."""
+    SIZE = 36
+
+    def __init__(self, data: Optional[Union[bytearray, memoryview]] = None):
+        # usually a view into TPA memory, see Bdos.fcb_at
+        self.data = data if data is not None else bytearray(Fcb.SIZE)
+
+    @classmethod
+    def from_filespec(cls, filespec: FileSpec, data: Optional[Union[bytearray, memoryview]] = None) -> Fcb:
+        fcb = cls(data)
+        fcb.data[:] = bytes(Fcb.SIZE)
+        fcb.data[0] = filespec._drive.value + 1
+        fcb.data[1:12] = filespec.pattern()
+        return fcb
+
+    @property
+    def drive(self) -> int:
+        # 0 is the current drive, 1 - 16 select A - P
+        return self.data[0]
+
+    @property
+    def name(self) -> bytes:
+        return bytes(char & 0x7F for char in self.data[1:12])
+
+    @property
+    def rename_target(self) -> bytes:
+        return bytes(char & 0x7F for char in self.data[17:28])
+
+    @property
+    def open_mode(self) -> OpenMode:
+        # MP/M takes the mode from attribute bits f5' (unlocked) and f6' (read only)
+        if self.data[5] & 0x80:
+            return OpenMode.UNLOCKED
+        if self.data[6] & 0x80:
+            return OpenMode.READ_ONLY
+        return OpenMode.LOCKED
+
+    @property
+    def rc(self) -> int:
+        return self.data[15]
+
+    @rc.setter
+    def rc(self, value: int):
+        self.data[15] = value
+
+    @property
+    def sequential_record(self) -> int:
+        extent = ((self.data[14] & 0x3F) << 5) | (self.data[12] & 0x1F)
+        return extent * RECORDS_PER_EXTENT + (self.data[32] & 0x7F)
+
+    @sequential_record.setter
+    def sequential_record(self, value: int):
+        extent, record = divmod(value, RECORDS_PER_EXTENT)
+        self.data[12] = extent & 0x1F
+        self.data[14] = (extent >> 5) & 0x3F
+        self.data[32] = record
+
+    @property
+    def random_record(self) -> int:
+        return self.data[33] | (self.data[34] << 8) | (self.data[35] << 16)
+
+    @random_record.setter
+    def random_record(self, value: int):
+        self.data[33] = value & 0xFF
+        self.data[34] = (value >> 8) & 0xFF
+        self.data[35] = (value >> 16) & 0xFF
+
+
+class Disk(abc.ABC):
+    """File level view of a drive, as used by the BDOS."""
+    wide_blocks = True
+
+    @abc.abstractmethod
+    def search(self, user: int, pattern: bytes) -> List[DirEntry]:
+        pass
+
+    @abc.abstractmethod
+    def open(self, fcb: Fcb, user: int) -> BdosReturn:
+        pass
+
+    @abc.abstractmethod
+    def make(self, fcb: Fcb, user: int) -> BdosReturn:
+        pass
+
+    def close(self, fcb: Fcb, user: int) -> BdosReturn:
+        self.flush()
+        return BdosReturn.OK
+
+    @abc.abstractmethod
+    def delete(self, user: int, pattern: bytes) -> int:
+        pass
+
+    @abc.abstractmethod
+    def rename(self, user: int, old: bytes, new: bytes) -> int:
+        pass
+
+    @abc.abstractmethod
+    def read(self, fcb: Fcb, user: int, record: int, dest: memoryview, sequential: bool) -> BdosReturn:
+        pass
+
+    @abc.abstractmethod
+    def write(self, fcb: Fcb, user: int, record: int, src: bytes) -> BdosReturn:
+        pass
+
+    @abc.abstractmethod
+    def read_file(self, user: int, name: bytes) -> Iterator[bytes]:
+        # whole file, a block at a time, for built-ins that stream it
+        pass
+
+    def stats(self) -> Dict[str, int]:
+        return {}
+
+    def flush(self):
+        pass
+
+
+class CpmDisk(Disk):
+    """CP/M 2.2 file system on top of a DiskImage."""
+    def __init__(self, image: DiskImage, readahead_blocks: int = 8, cache_blocks: int = 64):
+        self.image = image
+        self.dpb = image.dpb
+        self.wide_blocks = self.dpb.wide_blocks
+        self.readahead_blocks = readahead_blocks
+        self._cache = BlockCache(image, capacity=max(cache_blocks, readahead_blocks + len(self.dpb.directory_blocks)))
+        self._entries_per_block = self.dpb.block_size // DIR_ENTRY_SIZE
+        self.entries: List[DirEntry] = []
+        # (user, name) -> {entry ordinal: directory slot}
+        self._index: Dict[Tuple[int, bytes], Dict[int, int]] = {}
+        self._allocated = bytearray(self.dpb.block_count)
+        self._next_block = 0
+        self._load_directory()
+
+    @property
+    def cache(self) -> BlockCache:
+        return self._cache
+
+    def _block(self, block: int) -> memoryview:
+        buffer = self._cache.get(block)
+        if buffer is None:
+            buffer = self._cache.load(block)
+        return buffer
+
+    def _load_directory(self):
+        dir_blocks = self.dpb.directory_blocks
+        # directory blocks are always the first blocks on the drive
+        self._cache.load(dir_blocks[0], len(dir_blocks))
+        for block in dir_blocks:
+            self._allocated[block] = 1
+
+        for slot in range(self.dpb.dir_entries):
+            block, offset = self._slot_location(slot)
+            data = self._block(block)[offset:offset + DIR_ENTRY_SIZE]
+            entry = DirEntry.from_bytes(data, self.dpb.wide_blocks)
+            self.entries.append(entry)
+            if entry.is_empty():
+                continue
+            self._index_add(slot)
+            for block in entry.blocks:
+                if 0 < block < self.dpb.block_count:
+                    self._allocated[block] = 1
+
+    def _slot_location(self, slot: int) -> Tuple[int, int]:
+        index, offset = divmod(slot, self._entries_per_block)
+        return self.dpb.directory_blocks[index], offset * DIR_ENTRY_SIZE
+
+    def _ordinal(self, entry: DirEntry) -> int:
+        return entry.extent // (self.dpb.exm + 1)
+
+    def _index_add(self, slot: int):
+        entry = self.entries[slot]
+        self._index.setdefault((entry.user, entry.key), {})[self._ordinal(entry)] = slot
+
+    def _index_remove(self, slot: int):
+        entry = self.entries[slot]
+        key = (entry.user, entry.key)
+        extents = self._index.get(key)
+        if extents is None:
+            return
+        extents.pop(self._ordinal(entry), None)
+        if not extents:
+            del self._index[key]
+
+    def _store_entry(self, slot: int):
+        self._store_entries([slot])
+
+    def _store_entries(self, slots: Iterable[int]):
+        touched = set()
+        for slot in slots:
+            block, offset = self._slot_location(slot)
+            buffer = self._block(block)
+            buffer[offset:offset + DIR_ENTRY_SIZE] = self.entries[slot].to_bytes(self.dpb.wide_blocks)
+            touched.add(block)
+        for block in touched:
+            self._cache.mark_dirty(block)
+
+    def _free_slot(self) -> Optional[int]:
+        for slot, entry in enumerate(self.entries):
+            if entry.is_empty():
+                return slot
+        return None
+
+    def _allocate_block(self, near: int) -> Optional[int]:
+        # prefer the block after the file's last one so reads stay sequential
+        count = self.dpb.block_count
+        start = near + 1 if near else self._next_block
+        for offset in range(count):
+            block = (start + offset) % count
+            if not self._allocated[block]:
+                self._allocated[block] = 1
+                self._next_block = block + 1
+                return block
+        return None
+
+    def _free_blocks(self, blocks: Iterable[int]):
+        for block in blocks:
+            if 0 < block < self.dpb.block_count:
+                self._allocated[block] = 0
+                self._cache.discard(block)
+
+    def _entry(self, user: int, name: bytes, ordinal: int) -> Optional[DirEntry]:
+        slot = self._index.get((user, name), {}).get(ordinal)
+        return None if slot is None else self.entries[slot]
+
+    def _entry_records(self, entry: DirEntry) -> int:
+        return (entry.extent & self.dpb.exm) * RECORDS_PER_EXTENT + entry.rc
+
+    def search(self, user: int, pattern: bytes) -> List[DirEntry]:
+        result = []
+        for (entry_user, name), extents in self._index.items():
+            if entry_user == user and name_matches(pattern, name):
+                result.append(self.entries[extents[min(extents)]])
+        return result
+
+    def open(self, fcb: Fcb, user: int) -> BdosReturn:
+        entry = self._entry(user, fcb.name, 0)
+        if entry is None:
+            return BdosReturn.ERROR
+
+        fcb.data[12:16] = bytes([0, 0, 0, min(self._entry_records(entry), RECORDS_PER_EXTENT)])
+        fcb.data[16:32] = entry.to_bytes(self.dpb.wide_blocks)[16:32]
+        fcb.data[32] = 0
+        return BdosReturn.OK
+
+    def make(self, fcb: Fcb, user: int) -> BdosReturn:
+        name = fcb.name
+        if (user, name) in self._index:
+            return BdosReturn.ERROR
+        slot = self._free_slot()
+        if slot is None:
+            return BdosReturn.ERROR
+
+        self.entries[slot] = DirEntry(user=user, name=name)
+        self._index_add(slot)
+        self._store_entry(slot)
+        fcb.data[12:33] = bytes(21)
+        return BdosReturn.OK
+
+    def delete(self, user: int, pattern: bytes) -> int:
+        # one pass over the index, then a single bitmap and directory update
+        slots: List[int] = []
+        for (entry_user, name), extents in list(self._index.items()):
+            if entry_user == user and name_matches(pattern, name):
+                slots.extend(extents.values())
+                del self._index[(entry_user, name)]
+        if not slots:
+            return 0
+
+        freed: List[int] = []
+        for slot in slots:
+            freed.extend(self.entries[slot].blocks)
+            self.entries[slot] = DirEntry()
+        self._free_blocks(freed)
+        self._store_entries(slots)
+        return len(slots)
+
+    def rename(self, user: int, old: bytes, new: bytes) -> int:
+        count = 0
+        for slot, entry in enumerate(self.entries):
+            if entry.is_empty() or entry.user != user or entry.key != old:
+                continue
+            self._index_remove(slot)
+            # keep the attribute bits of the original name
+            entry.name = bytes((have & 0x80) | want for have, want in zip(entry.name, new))
+            self._index_add(slot)
+            self._store_entry(slot)
+            count += 1
+        return count
+
+    def _readahead_run(self, user: int, name: bytes, record: int, first: int) -> int:
+        # count physically consecutive, uncached blocks of the file starting at first
+        count = 1
+        rpb = self.dpb.records_per_block
+        record = (record // rpb + 1) * rpb
+        while count < self.readahead_blocks:
+            ordinal, offset = divmod(record, self.dpb.records_per_entry)
+            entry = self._entry(user, name, ordinal)
+            if entry is None or offset // rpb >= len(entry.blocks):
+                break
+            block = entry.blocks[offset // rpb]
+            if block != first + count or self._cache.contains(block):
+                break
+            count += 1
+            record += rpb
+        return count
+
+    def read(self, fcb: Fcb, user: int, record: int, dest: memoryview, sequential: bool) -> BdosReturn:
+        name = fcb.name
+        ordinal, offset = divmod(record, self.dpb.records_per_entry)
+        entry = self._entry(user, name, ordinal)
+        if entry is None:
+            return BdosReturn.NO_EXTENT
+        if offset >= self._entry_records(entry):
+            return BdosReturn.EOF
+
+        slot, offset = divmod(offset, self.dpb.records_per_block)
+        block = entry.blocks[slot] if slot < len(entry.blocks) else 0
+        if block == 0:
+            return BdosReturn.NO_DATA
+
+        buffer = self._cache.get(block)
+        if buffer is None:
+            count = self._readahead_run(user, name, record, block) if sequential else 1
+            buffer = self._cache.load(block, count)
+
+        start = offset * RECORD_SIZE
+        dest[:RECORD_SIZE] = buffer[start:start + RECORD_SIZE]
+        return BdosReturn.OK
+
+    def write(self, fcb: Fcb, user: int, record: int, src: bytes) -> BdosReturn:
+        name = fcb.name
+        ordinal, offset = divmod(record, self.dpb.records_per_entry)
+        if ordinal > 0x7FF // (self.dpb.exm + 1):
+            return BdosReturn.OUT_OF_RANGE
+
+        extents = self._index.get((user, name))
+        if extents is None:
+            return BdosReturn.ERROR
+
+        slot = extents.get(ordinal)
+        if slot is None:
+            slot = self._free_slot()
+            if slot is None:
+                return BdosReturn.DIRECTORY_FULL
+            self.entries[slot] = DirEntry(user=user, name=name, extent=ordinal * (self.dpb.exm + 1))
+            self._index_add(slot)
+        entry = self.entries[slot]
+
+        index, block_offset = divmod(offset, self.dpb.records_per_block)
+        if index >= len(entry.blocks):
+            entry.blocks.extend([0] * (index + 1 - len(entry.blocks)))
+        block = entry.blocks[index]
+        if block == 0:
+            previous = [block for block in entry.blocks if block]
+            block = self._allocate_block(previous[-1] if previous else 0)
+            if block is None:
+                return BdosReturn.DISK_FULL
+            entry.blocks[index] = block
+            buffer = self._cache.new(block)
+        else:
+            buffer = self._block(block)
+
+        start = block_offset * RECORD_SIZE
+        buffer[start:start + RECORD_SIZE] = src[:RECORD_SIZE]
+        self._cache.mark_dirty(block)
+
+        extent, extent_record = divmod(record, RECORDS_PER_EXTENT)
+        if extent > entry.extent:
+            entry.extent = extent
+            entry.rc = extent_record + 1
+        elif extent == entry.extent:
+            entry.rc = max(entry.rc, extent_record + 1)
+        self._store_entry(slot)
+        return BdosReturn.OK
+
+    def read_file(self, user: int, name: bytes) -> Iterator[bytes]:
+        extents = self._index.get((user, name), {})
+        rpb = self.dpb.records_per_block
+        for ordinal in sorted(extents):
+            entry = self.entries[extents[ordinal]]
+            records = self._entry_records(entry)
+            for index in range((records + rpb - 1) // rpb):
+                block = entry.blocks[index]
+                if block == 0:
+                    continue
+                buffer = self._cache.get(block)
+                if buffer is None:
+                    record = ordinal * self.dpb.records_per_entry + index * rpb
+                    buffer = self._cache.load(block, self._readahead_run(user, name, record, block))
+                yield bytes(buffer[:min(rpb, records - index * rpb) * RECORD_SIZE])
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'read_ops': self.image.read_ops,
+            'write_ops': self.image.write_ops,
+            'bytes_read': self._cache.bytes_read,
+            'bytes_written': self._cache.bytes_written,
+            'cache_hits': self._cache.hits,
+            'cache_misses': self._cache.misses,
+        }
+
+    def flush(self):
+        self._cache.flush()
+
+
+@dataclasses.dataclass
+class HostListing:
+    mtime: int
+    # 8.3 name -> host file name, and the size of each file
+    names: Dict[bytes, str]
+    sizes: Dict[bytes, int]
+
+
+class HostDisk(Disk):
+    """
+    Drive backed by a host directory, laid out the way RunCPM does it:
+        <root>/0/FILE.COM   user 0
+        <root>/F/FILE.COM   user 15
+
+    Listings are cached per user area and only rescanned when the directory
+    mtime changes, so DIR and SEARCH cost a single stat.
+    """
+    INVALID_CHARS = FileSpec.RESERVED_CHARS | FileSpec.WILDCARD_ALL | FileSpec.WILDCARD_SINGLE | set([' ', ':'])
+
+    def __init__(self, root: str, buffer_size: int = 16384, max_open: int = 16):
+        self.root = root
+        self._buffer_size = buffer_size
+        self._max_open = max_open
+        self._listings: Dict[int, HostListing] = {}
+        self._handles: collections.OrderedDict[Tuple[int, bytes], object] = collections.OrderedDict()
+        self.scans = 0
+        self.listing_hits = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def user_dir(self, user: int) -> str:
+        return os.path.join(self.root, f'{user:X}')
+
+    @classmethod
+    def to_cpm_name(cls, filename: str) -> Optional[bytes]:
+        name, dot, ext = filename.upper().rpartition('.')
+        if not dot:
+            name, ext = ext, ''
+        if not name or len(name) > 8 or len(ext) > 3:
+            return None
+        if any(char in cls.INVALID_CHARS or char in FileSpec.DELIM or not char.isprintable() or not char.isascii()
+               for char in name + ext):
+            return None
+        return (name.ljust(8) + ext.ljust(3)).encode('ascii')
+
+    @staticmethod
+    def to_host_name(name: bytes) -> str:
+        filename = name[:8].decode('ascii').rstrip()
+        ext = name[8:].decode('ascii').rstrip()
+        return f'{filename}.{ext}' if ext else filename
+
+    @classmethod
+    def is_valid_name(cls, name: bytes) -> bool:
+        # only names that round trip stay inside the user directory, no '/', '..' or blanks
+        try:
+            return cls.to_cpm_name(cls.to_host_name(name)) == name
+        except UnicodeDecodeError:
+            return False
+
+    def listing(self, user: int) -> HostListing:
+        path = self.user_dir(user)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            # missing, or not a directory; the drive just looks empty
+            mtime = -1
+
+        listing = self._listings.get(user)
+        if listing is not None and listing.mtime == mtime:
+            self.listing_hits += 1
+            return listing
+
+        self.scans += 1
+        listing = HostListing(mtime=mtime, names={}, sizes={})
+        if mtime >= 0:
+            with os.scandir(path) as entries:
+                for entry in sorted(entries, key=lambda entry: entry.name):
+                    if not entry.is_file():
+                        continue
+                    name = self.to_cpm_name(entry.name)
+                    # first host name wins when two map onto the same 8.3 name
+                    if name is None or name in listing.names:
+                        continue
+                    listing.names[name] = entry.name
+                    listing.sizes[name] = entry.stat().st_size
+        self._listings[user] = listing
+        return listing
+
+    def invalidate(self, user: Optional[int] = None):
+        if user is None:
+            self._listings.clear()
+        else:
+            self._listings.pop(user, None)
+
+    def _refresh_mtime(self, user: int):
+        # our own changes touch the directory; keep the cached listing valid.
+        # Only for changes that cannot collide with files the listing skipped
+        listing = self._listings.get(user)
+        if listing is not None:
+            listing.mtime = os.stat(self.user_dir(user)).st_mtime_ns
+
+    def _entry(self, user: int, name: bytes, size: int) -> DirEntry:
+        records = (size + RECORD_SIZE - 1) // RECORD_SIZE
+        return DirEntry(user=user, name=name, rc=min(records, RECORDS_PER_EXTENT))
+
+    def search(self, user: int, pattern: bytes) -> List[DirEntry]:
+        listing = self.listing(user)
+        return [self._entry(user, name, listing.sizes[name])
+                for name in listing.names if name_matches(pattern, name)]
+
+    def _close_handle(self, key: Tuple[int, bytes]):
+        handle = self._handles.pop(key, None)
+        if handle is None:
+            return
+        handle.close()
+        listing = self._listings.get(key[0])
+        if listing is not None and key[1] in listing.names:
+            listing.sizes[key[1]] = os.path.getsize(os.path.join(self.user_dir(key[0]), listing.names[key[1]]))
+
+    def _handle(self, user: int, name: bytes):
+        key = (user, name)
+        handle = self._handles.get(key)
+        if handle is not None:
+            self._handles.move_to_end(key)
+            return handle
+
+        host_name = self.listing(user).names.get(name)
+        if host_name is None:
+            return None
+        path = os.path.join(self.user_dir(user), host_name)
+        try:
+            handle = open(path, 'r+b', buffering=self._buffer_size)
+        except PermissionError:
+            handle = open(path, 'rb', buffering=self._buffer_size)
+
+        self._handles[key] = handle
+        while len(self._handles) > self._max_open:
+            self._close_handle(next(iter(self._handles)))
+        return handle
+
+    def open(self, fcb: Fcb, user: int) -> BdosReturn:
+        name = fcb.name
+        if self._handle(user, name) is None:
+            return BdosReturn.ERROR
+
+        fcb.data[12:16] = bytes([0, 0, 0, self._entry(user, name, self.listing(user).sizes[name]).rc])
+        fcb.data[32] = 0
+        return BdosReturn.OK
+
+    def make(self, fcb: Fcb, user: int) -> BdosReturn:
+        name = fcb.name
+        if not self.is_valid_name(name):
+            return BdosReturn.ERROR
+        listing = self.listing(user)
+        if name in listing.names:
+            return BdosReturn.ERROR
+
+        host_name = self.to_host_name(name)
+        try:
+            os.makedirs(self.user_dir(user), exist_ok=True)
+            # never truncate a host file the listing skipped, e.g. a case twin
+            open(os.path.join(self.user_dir(user), host_name), 'xb').close()
+        except OSError:
+            return BdosReturn.ERROR
+        listing.names[name] = host_name
+        listing.sizes[name] = 0
+        self._refresh_mtime(user)
+        fcb.data[12:33] = bytes(21)
+        return BdosReturn.OK
+
+    def close(self, fcb: Fcb, user: int) -> BdosReturn:
+        self._close_handle((user, fcb.name))
+        return BdosReturn.OK
+
+    def delete(self, user: int, pattern: bytes) -> int:
+        listing = self.listing(user)
+        matches = [name for name in listing.names if name_matches(pattern, name)]
+        deleted = 0
+        for name in matches:
+            self._close_handle((user, name))
+            try:
+                os.remove(os.path.join(self.user_dir(user), listing.names[name]))
+                deleted += 1
+            except OSError:
+                pass
+        if matches:
+            # a skipped file with the same 8.3 name may show up now
+            self.invalidate(user)
+        return deleted
+
+    def rename(self, user: int, old: bytes, new: bytes) -> int:
+        listing = self.listing(user)
+        if old not in listing.names or new in listing.names or not self.is_valid_name(new):
+            return 0
+
+        target = os.path.join(self.user_dir(user), self.to_host_name(new))
+        if os.path.lexists(target):
+            return 0
+        self._close_handle((user, old))
+        try:
+            os.rename(os.path.join(self.user_dir(user), listing.names[old]), target)
+        except OSError:
+            return 0
+        finally:
+            self.invalidate(user)
+        return 1
+
+    def read(self, fcb: Fcb, user: int, record: int, dest: memoryview, sequential: bool) -> BdosReturn:
+        handle = self._handle(user, fcb.name)
+        if handle is None:
+            return BdosReturn.NO_EXTENT
+
+        handle.seek(record * RECORD_SIZE)
+        count = handle.readinto(memoryview(dest)[:RECORD_SIZE])
+        if not count:
+            return BdosReturn.EOF
+        if count < RECORD_SIZE:
+            dest[count:RECORD_SIZE] = bytes([EOF_BYTE]) * (RECORD_SIZE - count)
+        self.bytes_read += RECORD_SIZE
+        return BdosReturn.OK
+
+    def write(self, fcb: Fcb, user: int, record: int, src: bytes) -> BdosReturn:
+        handle = self._handle(user, fcb.name)
+        if handle is None:
+            return BdosReturn.ERROR
+
+        try:
+            handle.seek(record * RECORD_SIZE)
+            handle.write(src[:RECORD_SIZE])
+        except OSError:
+            return BdosReturn.DISK_FULL
+        self.bytes_written += RECORD_SIZE
+        return BdosReturn.OK
+
+    def read_file(self, user: int, name: bytes) -> Iterator[bytes]:
+        host_name = self.listing(user).names.get(name)
+        if host_name is None:
+            return
+        handle = self._handles.get((user, name))
+        if handle is not None:
+            handle.flush()
+        with open(os.path.join(self.user_dir(user), host_name), 'rb') as file:
+            while True:
+                chunk = file.read(self._buffer_size)
+                if not chunk:
+                    break
+                self.bytes_read += len(chunk)
+                yield chunk
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'cache_hits': self.listing_hits,
+            'cache_misses': self.scans,
+        }
+
+    def flush(self):
+        for handle in self._handles.values():
+            handle.flush()
+
+
+class FileLock:
+    """Opens and record locks held on one file by every session sharing its drive."""
+    __slots__ = ('mode', 'openers', 'records', '_released')
+
+    def __init__(self, mode: OpenMode):
+        self.mode = mode
+        self.openers: Set[object] = set()
+        # record -> owner, only used in UNLOCKED mode
+        self.records: Dict[int, object] = {}
+        self._released: Optional[asyncio.Event] = None
+
+    def released(self) -> asyncio.Event:
+        if self._released is None:
+            self._released = asyncio.Event()
+        return self._released
+
+    def notify(self):
+        if self._released is not None:
+            self._released.set()
+            self._released = None
+
+
+class LockManager:
+    """
+    MP/M style file and record locks for drives shared between sessions.
+    A drive is shared by mounting the same Disk in every Bdos that was given
+    the same LockManager. Locks are kept per file, so sessions working on
+    different files never wait on each other.
+    """
+    def __init__(self, max_record_locks: int = 16):
+        self.max_record_locks = max_record_locks
+        self._files: Dict[Tuple[Disk, int, bytes], FileLock] = {}
+        self.conflicts = 0
+        self.waits = 0
+
+    def open(self, owner, disk: Disk, user: int, name: bytes, mode: OpenMode) -> BdosReturn:
+        key = (disk, user, name)
+        lock = self._files.get(key)
+        if lock is None:
+            lock = self._files[key] = FileLock(mode)
+        elif not lock.openers - {owner}:
+            lock.mode = mode
+        elif mode != lock.mode or mode == OpenMode.LOCKED:
+            self.conflicts += 1
+            return BdosReturn.FILE_IN_USE
+        lock.openers.add(owner)
+        return BdosReturn.OK
+
+    def close(self, owner, disk: Disk, user: int, name: bytes):
+        key = (disk, user, name)
+        lock = self._files.get(key)
+        if lock is None or owner not in lock.openers:
+            return
+        lock.openers.discard(owner)
+        for record in [record for record, holder in lock.records.items() if holder is owner]:
+            del lock.records[record]
+        if not lock.openers:
+            del self._files[key]
+        lock.notify()
+
+    def release(self, owner, disk: Optional[Disk] = None):
+        # everything owner holds, on one drive or all of them
+        for key in [key for key, lock in self._files.items()
+                    if owner in lock.openers and (disk is None or key[0] is disk)]:
+            self.close(owner, *key)
+
+    def discard(self, disk: Disk, user: int, pattern: bytes):
+        # the files are gone, e.g. erased or renamed
+        for key in [key for key in self._files if key[0] is disk and key[1] == user
+                    and name_matches(pattern, key[2])]:
+            self._files.pop(key).notify()
+
+    def in_use(self, owner, disk: Disk, user: int, pattern: bytes, exclusive: bool = True) -> bool:
+        # exclusive access conflicts with any other opener, reading only with LOCKED ones
+        for (lock_disk, lock_user, name), lock in self._files.items():
+            if lock_disk is not disk or lock_user != user or not lock.openers - {owner}:
+                continue
+            if (exclusive or lock.mode == OpenMode.LOCKED) and name_matches(pattern, name):
+                self.conflicts += 1
+                return True
+        return False
+
+    def check_write(self, owner, disk: Disk, user: int, name: bytes, record: int) -> BdosReturn:
+        lock = self._files.get((disk, user, name))
+        if lock is None:
+            return BdosReturn.OK
+        if owner not in lock.openers and lock.mode == OpenMode.LOCKED:
+            self.conflicts += 1
+            return BdosReturn.FILE_IN_USE
+        if lock.mode == OpenMode.READ_ONLY:
+            return BdosReturn.ERROR
+        holder = lock.records.get(record, owner)
+        if holder is not owner:
+            self.conflicts += 1
+            return BdosReturn.RECORD_LOCKED
+        return BdosReturn.OK
+
+    def lock_record(self, owner, disk: Disk, user: int, name: bytes, record: int) -> BdosReturn:
+        lock = self._files.get((disk, user, name))
+        if lock is None or owner not in lock.openers:
+            return BdosReturn.ERROR
+        if lock.mode != OpenMode.UNLOCKED:
+            # nobody else can write the file anyway
+            return BdosReturn.OK
+
+        holder = lock.records.get(record)
+        if holder is owner:
+            return BdosReturn.OK
+        if holder is not None:
+            self.conflicts += 1
+            return BdosReturn.RECORD_LOCKED
+        if sum(1 for holder in lock.records.values() if holder is owner) >= self.max_record_locks:
+            return BdosReturn.LOCK_LIMIT
+        lock.records[record] = owner
+        return BdosReturn.OK
+
+    def unlock_record(self, owner, disk: Disk, user: int, name: bytes, record: int) -> BdosReturn:
+        lock = self._files.get((disk, user, name))
+        if lock is None or owner not in lock.openers:
+            return BdosReturn.ERROR
+        if lock.records.get(record) is owner:
+            del lock.records[record]
+            lock.notify()
+        return BdosReturn.OK
+
+    async def wait_record(self, owner, disk: Disk, user: int, name: bytes, record: int,
+                          timeout: Optional[float] = None) -> BdosReturn:
+        """
+        lock_record that waits for the holder to let go instead of
+        returning RECORD_LOCKED, or until timeout seconds have passed.
+        """
+        async def wait() -> BdosReturn:
+            while True:
+                result = self.lock_record(owner, disk, user, name, record)
+                if result != BdosReturn.RECORD_LOCKED:
+                    return result
+                self.waits += 1
+                await self._files[(disk, user, name)].released().wait()
+
+        try:
+            return await asyncio.wait_for(wait(), timeout)
+        except asyncio.TimeoutError:
+            return BdosReturn.RECORD_LOCKED
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'open_files': len(self._files),
+            'record_locks': sum(len(lock.records) for lock in self._files.values()),
+            'conflicts': self.conflicts,
+            'waits': self.waits,
+        }
+
+
+class Bdos:
+    def __init__(self, state: CpmState, locks: Optional[LockManager] = None):
+        self._state = state
+        # shared by every session that mounts the same drives
+        self.locks = locks if locks is not None else LockManager()
+        self._disks: Dict[DiskDrive, Disk] = {}
+        self._memory = memoryview(state.memory)
+        self._dma_address = DEFAULT_DMA
+        self._dma = self._memory[DEFAULT_DMA:DEFAULT_DMA + RECORD_SIZE]
+        # drive -> (user, name, record) of the last record read
+        self._last_read: Dict[DiskDrive, Tuple[int, bytes, int]] = {}
+        self._search_results: List[DirEntry] = []
+        self._search_disk: Optional[Disk] = None
+        self._file_chunks: Iterator[bytes] = iter(())
+        # called with (opcode, arg, result) after every call, for recording
+        self.trace: Optional[Callable[[BdosOpcode, object, BdosReturn], None]] = None
+        self._handlers = {
+            BdosOpcode.SEARCH: self.search,
+            BdosOpcode.SEARCH_NEXT: self.search_next,
+            BdosOpcode.OPEN: self.open,
+            BdosOpcode.CLOSE: self.close,
+            BdosOpcode.MAKE: self.make,
+            BdosOpcode.DELETE: self.delete,
+            BdosOpcode.RENAME: self.rename,
+            BdosOpcode.READ: self.read,
+            BdosOpcode.WRITE: self.write,
+            BdosOpcode.READ_RANDOM: self.read_random,
+            BdosOpcode.WRITE_RANDOM: self.write_random,
+            BdosOpcode.SET_DMA: self.set_dma,
+            BdosOpcode.SELECT: self.select,
+            BdosOpcode.READ_FILE: self.read_file,
+            BdosOpcode.LOCK_RECORD: self.lock_record,
+            BdosOpcode.UNLOCK_RECORD: self.unlock_record,
+        }
+
+    def call(self, opcode: BdosOpcode, arg = None) -> BdosReturn:
+        stats = self._state.stats
+        if not stats.enabled and self.trace is None:
+            return self._dispatch(opcode, arg)
+
+        start = time.perf_counter()
+        result = self._dispatch(opcode, arg)
+        if stats.enabled:
+            stats.record_bdos(opcode, time.perf_counter() - start)
+        if self.trace is not None:
+            self.trace(opcode, arg, result)
+        return result
+
+    def _dispatch(self, opcode: BdosOpcode, arg) -> BdosReturn:
+        if arg is None:
+            return self._handlers[opcode]()
+        return self._handlers[opcode](arg)
+
+    def mount(self, drive: DiskDrive, disk: Disk):
+        self.unmount(drive)
+        self._disks[drive] = disk
+        self._state.log_event(CcpMessage(f'Mounted {type(disk).__name__} on {drive}:'), source='bdos')
+
+    def unmount(self, drive: DiskDrive) -> Optional[Disk]:
+        disk = self._disks.pop(drive, None)
+        if disk is not None:
+            disk.flush()
+            self.locks.release(self, disk)
+        self._last_read.pop(drive, None)
+        return disk
+
+    def disk(self, drive: DiskDrive) -> Optional[Disk]:
+        return self._disks.get(drive)
+
+    def disks(self) -> List[Tuple[DiskDrive, Disk]]:
+        return sorted(self._disks.items(), key=lambda item: item[0].value)
+
+    @property
+    def dma(self) -> memoryview:
+        return self._dma
+
+    @property
+    def dma_address(self) -> int:
+        return self._dma_address
+
+    def set_dma(self, address: int) -> BdosReturn:
+        # the DMA buffer is a view of TPA memory, records land there directly
+        if not 0 <= address <= len(self._memory) - RECORD_SIZE:
+            return BdosReturn.ERROR
+        self._dma_address = address
+        self._dma = self._memory[address:address + RECORD_SIZE]
+        return BdosReturn.OK
+
+    def fcb_at(self, address: int) -> Fcb:
+        return Fcb(self._memory[address:address + Fcb.SIZE])
+
+    def select(self, drive: DiskDrive) -> BdosReturn:
+        if drive not in self._disks:
+            self._state.log_error(CcpMessage(f'Bdos err on {drive}: select'), source='bdos')
+            return BdosReturn.ERROR
+        self._state.drive = drive
+        return BdosReturn.OK
+
+    def flush(self):
+        for disk in self._disks.values():
+            disk.flush()
+
+    def release_locks(self):
+        self.locks.release(self)
+
+    def _resolve(self, fcb: Fcb) -> Tuple[Optional[DiskDrive], Optional[Disk]]:
+        if fcb.drive == 0:
+            drive = self._state.drive
+        elif fcb.drive <= len(DISK_VALUES):
+            drive = DiskDrive(fcb.drive - 1)
+        else:
+            return None, None
+        return drive, self._disks.get(drive)
+
+    def _user(self) -> int:
+        return self._state.user.value
+
+    def search(self, fcb: Fcb) -> BdosReturn:
+        drive, disk = self._resolve(fcb)
+        self._search_disk = disk
+        self._search_results = [] if disk is None else disk.search(self._user(), fcb.name)
+        return self.search_next()
+
+    def search_next(self) -> BdosReturn:
+        if not self._search_results:
+            return BdosReturn.ERROR
+        entry = self._search_results.pop(0)
+        # directory code 0, the entry is always the first in the record
+        self._dma[:RECORD_SIZE] = bytes([EMPTY_BYTE]) * RECORD_SIZE
+        self._dma[:DIR_ENTRY_SIZE] = entry.to_bytes(self._search_disk.wide_blocks)
+        return BdosReturn.OK
+
+    def open(self, fcb: Fcb) -> BdosReturn:
+        drive, disk = self._resolve(fcb)
+        if disk is None:
+            return BdosReturn.ERROR
+        user = self._user()
+        result = disk.open(fcb, user)
+        if result == BdosReturn.OK:
+            result = self.locks.open(self, disk, user, fcb.name, fcb.open_mode)
+        return result
+
+    def close(self, fcb: Fcb) -> BdosReturn:
+        drive, disk = self._resolve(fcb)
+        if disk is None:
+            return BdosReturn.ERROR
+        user = self._user()
+        self._last_read.pop(drive, None)
+        result = disk.close(fcb, user)
+        self.locks.close(self, disk, user, fcb.name)
+        return result
+
+    def make(self, fcb: Fcb) -> BdosReturn:
+        drive, disk = self._resolve(fcb)
+        if disk is None:
+            return BdosReturn.ERROR
+        user = self._user()
+        if self.locks.in_use(self, disk, user, fcb.name):
+            return BdosReturn.FILE_IN_USE
+        result = disk.make(fcb, user)
+        if result == BdosReturn.OK:
+            result = self.locks.open(self, disk, user, fcb.name, fcb.open_mode)
+        return result
+
+    def delete(self, fcb: Fcb) -> BdosReturn:
+        drive, disk = self._resolve(fcb)
+        if disk is None:
+            return BdosReturn.ERROR
+        user = self._user()
+        if self.locks.in_use(self, disk, user, fcb.name):
+            return BdosReturn.FILE_IN_USE
+        if disk.delete(user, fcb.name) == 0:
+            return BdosReturn.ERROR
+        self.locks.discard(disk, user, fcb.name)
+        disk.flush()
+        return BdosReturn.OK
+
+    def rename(self, fcb: Fcb) -> BdosReturn:
+        drive, disk = self._resolve(fcb)
+        if disk is None:
+            return BdosReturn.ERROR
+        user = self._user()
+        if self.locks.in_use(self, disk, user, fcb.name) or self.locks.in_use(self, disk, user, fcb.rename_target):
+            return BdosReturn.FILE_IN_USE
+        if disk.rename(user, fcb.name, fcb.rename_target) == 0:
+            return BdosReturn.ERROR
+        self.locks.discard(disk, user, fcb.name)
+        disk.flush()
+        return BdosReturn.OK
+
+    def _read(self, fcb: Fcb, record: int) -> BdosReturn:
+        drive, disk = self._resolve(fcb)
+        if disk is None:
+            return BdosReturn.ERROR
+
+        user = self._user()
+        name = fcb.name
+        sequential = self._last_read.get(drive) == (user, name, record - 1)
+        result = disk.read(fcb, user, record, self._dma, sequential)
+        if result == BdosReturn.OK:
+            self._last_read[drive] = (user, name, record)
+        return result
+
+    def read(self, fcb: Fcb) -> BdosReturn:
+        record = fcb.sequential_record
+        result = self._read(fcb, record)
+        if result == BdosReturn.OK:
+            fcb.sequential_record = record + 1
+        elif result != BdosReturn.ERROR:
+            result = BdosReturn.EOF
+        return result
+
+    def read_random(self, fcb: Fcb) -> BdosReturn:
+        record = fcb.random_record
+        if record > 0xFFFF:
+            return BdosReturn.OUT_OF_RANGE
+        result = self._read(fcb, record)
+        if result == BdosReturn.OK:
+            # random reads leave the sequential position on the record just read
+            fcb.sequential_record = record
+        return result
+
+    def _write(self, fcb: Fcb, record: int) -> BdosReturn:
+        drive, disk = self._resolve(fcb)
+        if disk is None:
+            return BdosReturn.ERROR
+        user = self._user()
+        result = self.locks.check_write(self, disk, user, fcb.name, record)
+        if result != BdosReturn.OK:
+            return result
+        return disk.write(fcb, user, record, self._dma)
+
+    def write(self, fcb: Fcb) -> BdosReturn:
+        record = fcb.sequential_record
+        result = self._write(fcb, record)
+        if result == BdosReturn.OK:
+            fcb.sequential_record = record + 1
+        return result
+
+    def write_random(self, fcb: Fcb) -> BdosReturn:
+        record = fcb.random_record
+        if record > 0xFFFF:
+            return BdosReturn.OUT_OF_RANGE
+        result = self._write(fcb, record)
+        if result == BdosReturn.OK:
+            fcb.sequential_record = record
+        return result
+
+    def read_file(self, fcb: Fcb) -> BdosReturn:
+        # TYPE fast path, the whole file a block at a time through file_chunks()
+        self._file_chunks = iter(())
+        drive, disk = self._resolve(fcb)
+        if disk is None:
+            return BdosReturn.ERROR
+        user = self._user()
+        name = fcb.name
+        if not disk.search(user, name):
+            return BdosReturn.ERROR
+        if self.locks.in_use(self, disk, user, name, exclusive=False):
+            return BdosReturn.FILE_IN_USE
+        self._file_chunks = disk.read_file(user, name)
+        return BdosReturn.OK
+
+    def file_chunks(self) -> Iterator[bytes]:
+        chunks, self._file_chunks = self._file_chunks, iter(())
+        return chunks
+
+    def lock_record(self, fcb: Fcb) -> BdosReturn:
+        # MP/M takes the record from the random record field
+        drive, disk = self._resolve(fcb)
+        if disk is None:
+            return BdosReturn.ERROR
+        return self.locks.lock_record(self, disk, self._user(), fcb.name, fcb.random_record)
+
+    def unlock_record(self, fcb: Fcb) -> BdosReturn:
+        drive, disk = self._resolve(fcb)
+        if disk is None:
+            return BdosReturn.ERROR
+        return self.locks.unlock_record(self, disk, self._user(), fcb.name, fcb.random_record)
+
+    async def wait_record(self, fcb: Fcb, timeout: Optional[float] = None) -> BdosReturn:
+        drive, disk = self._resolve(fcb)
+        if disk is None:
+            return BdosReturn.ERROR
+        return await self.locks.wait_record(self, disk, self._user(), fcb.name, fcb.random_record, timeout)
+
+
 class Tpa:
-    def __init__(self, state: CpmState):
+    def __init__(self, state: CpmState, bdos: Optional[Bdos] = None):
         self.state = state
+        self.bdos = bdos
+        self.memory = memoryview(state.memory)
         self.running = True
 
     def push_input(self, value: str):
@@ -389,82 +2430,351 @@ class Tpa:
     def terminate(self):
         self.running = False
 
-class ProgramDir(Tpa):
+class Builtin(Tpa):
+    # CCP built-ins run to completion unless they need more input
+    def __init__(self, state: CpmState, bdos: Bdos):
+        super().__init__(state, bdos)
+        self.output: CcpMessage = CcpMessage()
+        self.prompt = ''
+
+    def _parse(self, value: str, allow_empty: bool = False) -> Optional[FileSpec]:
+        filespec = FileSpec.from_str(value=value, state=self.state)
+        if filespec is None or not filespec.is_valid(allow_empty):
+            self.output = CcpMessage('Invalid filespec.')
+            return None
+        return filespec
+
+    def _disk(self, filespec: FileSpec) -> Optional[Disk]:
+        disk = self.bdos.disk(filespec._drive)
+        if disk is None:
+            self.output = CcpMessage(f'Bdos err on {filespec._drive}: select')
+        return disk
+
+    def _fcb(self, filespec: FileSpec) -> Fcb:
+        # built-ins go through the BDOS with the default FCB, as the CCP does
+        return Fcb.from_filespec(filespec, self.bdos.fcb_at(DEFAULT_FCB).data)
+
+    def _call(self, opcode: BdosOpcode, arg = None) -> BdosReturn:
+        result = self.bdos.call(opcode, arg)
+        if result == BdosReturn.FILE_IN_USE:
+            self.output = CcpMessage('FILE IN USE')
+        return result
+
+    def _export(self, text: str, path: str):
+        # json to the console, or to a host file when a path is given
+        path = path.strip()
+        if not path:
+            self.output = CcpMessage(text)
+            return
+        try:
+            with open(path, 'w') as file:
+                file.write(text)
+        except OSError as err:
+            self.output = CcpMessage(f'Unable to write {path}: {err.strerror or err}')
+            self.state.log_error(self.output)
+
+    def pop_output(self) -> CcpMessage:
+        return self.output
+
+class ProgramDir(Builtin):
     # Equivalent to loading the program
-    def __init__(self, state):
-        super().__init__(state)
-        self.output: CcpMessage = CcpMessage(f'No file.') 
+    COLUMNS = 4
 
     def push_input(self, value: str):
-        if value == '':
-            # print contents of director
-            self.output = CcpMessage(f'Print dir {state.drive}.')
-        else:
-            # we should have a filespec
-            filespec = FileSpec.from_str(value=value, state=self.state)
-            if filespec is None:
-                self.output = CcpMessage('Invalid filespec.')
-            else:
-                self.output = CcpMessage(f'List filespec {filespec}')
+        self.terminate()
+        filespec = self._parse(value, allow_empty=True)
+        if filespec is None:
+            return
+        disk = self._disk(filespec)
+        if disk is None:
+            return
 
-    def pop_output(self) -> CcpMessage:
-        return self.output
-        
+        fcb = self._fcb(filespec)
+        if filespec.pattern().isspace():
+            # plain DIR or DIR d: lists everything
+            fcb.data[1:12] = b'?' * 11
+        keys = []
+        result = self._call(BdosOpcode.SEARCH, fcb)
+        while result == BdosReturn.OK:
+            keys.append(bytes(char & 0x7F for char in self.bdos.dma[1:12]))
+            result = self._call(BdosOpcode.SEARCH_NEXT)
+        if not keys:
+            self.output = CcpMessage('NO FILE')
+            return
 
+        self.output = CcpMessage(auto_lock=False)
+        names = [f'{key[:8].decode("ascii", "replace")} {key[8:].decode("ascii", "replace")}' for key in keys]
+        for index in range(0, len(names), ProgramDir.COLUMNS):
+            self.output.append(f'{filespec._drive}: ' + ' : '.join(names[index:index + ProgramDir.COLUMNS]))
+        self.output.lock()
 
-state = CpmState(drive=DiskDrive.A, 
-                 version=CpmVersion(major=2, minor=0), 
-                 user = User.USR0)
-bios = Bios(state=state)
+class ProgramEra(Builtin):
+    def __init__(self, state: CpmState, bdos: Bdos):
+        super().__init__(state, bdos)
+        self._pending: Optional[FileSpec] = None
 
-async def ccp_loop():
-    def boot_message(state: CpmState) -> CcpMessage:
-        return CcpMessage(f'CP/M VER {state.version}')        
+    def push_input(self, value: str):
+        if self._pending is not None:
+            # answer to ALL (Y/N)?
+            filespec, self._pending = self._pending, None
+            self.terminate()
+            if value.upper() == 'Y':
+                self._erase(filespec)
+            return
 
-    # ccp_locals = {}
+        filespec = self._parse(value) if value else None
+        if filespec is None:
+            self.output = CcpMessage('Invalid filespec.')
+            self.terminate()
+            return
+
+        if filespec.pattern() == b'?' * 11:
+            self._pending = filespec
+            self.prompt = 'ALL (Y/N)?'
+            return
+
+        self.terminate()
+        self._erase(filespec)
+
+    def _erase(self, filespec: FileSpec):
+        if self._disk(filespec) is None:
+            return
+        if self._call(BdosOpcode.DELETE, self._fcb(filespec)) == BdosReturn.ERROR:
+            self.output = CcpMessage('NO FILE')
+
+class ProgramRen(Builtin):
+    # ren new=old
+    def push_input(self, value: str):
+        self.terminate()
+        new_value, equals, old_value = value.partition('=')
+        if not equals:
+            self.output = CcpMessage('Invalid filespec.')
+            return
 
-    bios.print(boot_message(state))
-    while True:
-        cmd = await bios.get_input()
-        if cmd.is_quit():
-            break
+        new = self._parse(new_value.strip())
+        old = self._parse(old_value.strip())
+        if new is None or old is None:
+            return
+        if new.is_afn() or old.is_afn() or new._drive != old._drive:
+            self.output = CcpMessage('Invalid filespec.')
+            return
 
-        if cmd.is_err():
-            bios.print_error()
-            continue
+        if self._disk(old) is None:
+            return
+        if self._call(BdosOpcode.SEARCH, self._fcb(new)) == BdosReturn.OK:
+            self.output = CcpMessage('FILE EXISTS')
+            return
 
-        if cmd.is_cpm():
-            bios.print(CcpMessage(f'CPM: {cmd._opcode}'))
-            if cmd._opcode == CcpOpcode.DIR:
-                dir = ProgramDir(state=state)
-                dir.push_input(cmd._raw_value[4:])
-                bios.print(dir.pop_output())
+        fcb = self._fcb(old)
+        fcb.data[16] = fcb.data[0]
+        fcb.data[17:28] = new.pattern()
+        if self._call(BdosOpcode.RENAME, fcb) == BdosReturn.ERROR:
+            self.output = CcpMessage('NO FILE')
 
+class ProgramType(Builtin):
+    def __init__(self, state: CpmState, bdos: Bdos):
+        super().__init__(state, bdos)
+        self._chunks: Iterator[bytes] = iter(())
 
+    def push_input(self, value: str):
+        self.terminate()
+        filespec = self._parse(value)
+        if filespec is None:
+            return
+        if filespec.is_afn():
+            self.output = CcpMessage('Invalid filespec.')
+            return
 
-            continue
+        if self._disk(filespec) is None:
+            return
+        result = self._call(BdosOpcode.READ_FILE, self._fcb(filespec))
+        if result == BdosReturn.ERROR:
+            self.output = CcpMessage('NO FILE')
+        elif result == BdosReturn.OK:
+            self._chunks = self.bdos.file_chunks()
 
-        # if cmd.is_python():
-        #     try:
-        #         exec(cmd._raw_value, globals(), ccp_locals)
-        #     except Exception as err:
-        #         bios.print(CcpMessage(f'ERR: {err}'))
-        #     continue
+    def chunks(self) -> Iterator[bytes]:
+        return self._chunks
 
-        # print error
-        err_string = '?'
+class ProgramSave(Builtin):
+    # save n ufn, writes n pages of the TPA starting at 0100h
+    def push_input(self, value: str):
+        self.terminate()
+        pages, _, name = value.partition(' ')
         try:
-            err_string = f'{cmd._raw_value.split(" ")[0].upper()}?'
-        except Exception:
-            pass
+            pages = int(pages)
+        except ValueError:
+            self.output = CcpMessage(f'{pages}?')
+            return
+        filespec = self._parse(name.strip())
+        if filespec is None:
+            return
+        if filespec.is_afn() or not 0 <= pages <= (MEMORY_SIZE - TPA_START) // PAGE_SIZE:
+            self.output = CcpMessage('Invalid filespec.')
+            return
 
-        bios.print(CcpMessage(err_string))
+        if self._disk(filespec) is None:
+            return
+        fcb = self._fcb(filespec)
+        if self._call(BdosOpcode.DELETE, fcb) == BdosReturn.FILE_IN_USE:
+            return
+        result = self._call(BdosOpcode.MAKE, fcb)
+        if result != BdosReturn.OK:
+            if result != BdosReturn.FILE_IN_USE:
+                self.output = CcpMessage('NO SPACE')
+            return
+
+        # the DMA address walks the TPA, so records are written straight from memory
+        for record in range(pages * PAGE_SIZE // RECORD_SIZE):
+            self._call(BdosOpcode.SET_DMA, TPA_START + record * RECORD_SIZE)
+            if self._call(BdosOpcode.WRITE, fcb) != BdosReturn.OK:
+                self.output = CcpMessage('NO SPACE')
+                break
+        self._call(BdosOpcode.SET_DMA, DEFAULT_DMA)
+        self._call(BdosOpcode.CLOSE, fcb)
+
+class ProgramErr(Builtin):
+    # err [n|all|json [path]]
+    def push_input(self, value: str):
+        self.terminate()
+        events = self.state.events
+        action, _, path = value.partition(' ')
+        action = action.lower()
+        if action == 'json':
+            self._export(events.to_json(), path)
+            return
+
+        if action == '':
+            msg = self.state.error_message
+            self.output = msg if msg is not None else CcpMessage('No error logged.')
+            return
+
+        if action == 'all':
+            records = list(events.records())
+        else:
+            try:
+                records = events.recent(int(action))
+            except ValueError:
+                self.output = CcpMessage(f'{action.upper()}?')
+                return
+
+        self.output = CcpMessage(auto_lock=False)
+        for record in reversed(records):
+            for entry in record.message.entries:
+                self.output.append(f'{record.seq:>4} {record.kind} {record.source}: {entry}')
+        if self.output.is_empty():
+            self.output.append('No error logged.')
+        self.output.lock()
+
+class ProgramStats(Builtin):
+    def push_input(self, value: str):
+        self.terminate()
+        stats = self.state.stats
+        action, _, path = value.partition(' ')
+        action = action.lower()
+        if action == '':
+            self.output = stats.as_message(self.bdos)
+        elif action == 'on':
+            stats.enabled = True
+        elif action == 'off':
+            stats.enabled = False
+        elif action == 'reset':
+            stats.reset()
+        elif action == 'json':
+            self._export(stats.to_json(self.bdos), path)
+        else:
+            self.output = CcpMessage(f'{action.upper()}?')
+
+
+def create_session(locks: Optional[LockManager] = None, disk: Optional[Disk] = None) -> Tuple[CpmState, Bios, Bdos]:
+    # sessions given the same locks and disk share drive A:
+    state = CpmState(drive=DiskDrive.A, 
+                     version=CpmVersion(major=2, minor=0), 
+                     user = User.USR0)
+    bios = Bios(state=state)
+    bdos = Bdos(state=state, locks=locks)
+    bdos.mount(DiskDrive.A, disk if disk is not None else CpmDisk(MemoryDiskImage(DPB_IBM_3740)))
+    return state, bios, bdos
+
+state, bios, bdos = create_session()
+
+async def ccp_loop(state: CpmState, bios: Bios, bdos: Bdos):
+    def boot_message(state: CpmState) -> CcpMessage:
+        return CcpMessage(f'CP/M VER {state.version}')        
+
+    # ccp_locals = {}
+
+    bios.devices.start()
+    finished = False
+    try:
+        await bios.print(boot_message(state))
+        while True:
+            cmd = await bios.get_input()
+            if cmd.is_quit():
+                break
+
+            if cmd.is_err():
+                if cmd.args:
+                    program = ProgramErr(state=state, bdos=bdos)
+                    program.push_input(cmd.args)
+                    await bios.print(program.pop_output())
+                else:
+                    await bios.print_error()
+                continue
+
+            if cmd.is_cpm():
+                started = time.perf_counter() if state.stats.enabled else None
+                await bios.print(CcpMessage(f'CPM: {cmd._opcode}'))
+                programs = {
+                    CcpOpcode.DIR: ProgramDir,
+                    CcpOpcode.ERA: ProgramEra,
+                    CcpOpcode.REN: ProgramRen,
+                    CcpOpcode.TYPE: ProgramType,
+                    CcpOpcode.SAVE: ProgramSave,
+                    CcpOpcode.STATS: ProgramStats,
+                }
+                program_class = programs.get(cmd._opcode)
+                if program_class is not None:
+                    program = program_class(state=state, bdos=bdos)
+                    program.push_input(cmd.args)
+                    while program.is_running():
+                        program.push_input(await bios.get_line(program.prompt))
+                    if isinstance(program, ProgramType):
+                        await bios.stream(program.chunks())
+                    await bios.print(program.pop_output())
+
+                if started is not None:
+                    state.stats.record_command(str(cmd._opcode), time.perf_counter() - started)
+                continue
+
+            # if cmd.is_python():
+            #     try:
+            #         exec(cmd._raw_value, globals(), ccp_locals)
+            #     except Exception as err:
+            #         bios.print(CcpMessage(f'ERR: {err}'))
+            #     continue
+
+            # print error
+            err_string = '?'
+            try:
+                err_string = f'{cmd._raw_value.split(" ")[0].upper()}?'
+            except Exception:
+                pass
+
+            err_msg = CcpMessage(err_string)
+            state.log_error(err_msg)
+            await bios.print(err_msg)
+        finished = True
+    finally:
+        # even when a command fails, other sessions must not see our files as in use
+        bdos.release_locks()
+        await bios.devices.stop(drain=finished)
 
 
 async def main():
     tasks = []
     # tasks.append(asyncio.create_task(blink(pin="test", count=5)))
-    tasks.append(asyncio.create_task(ccp_loop()))
+    tasks.append(asyncio.create_task(ccp_loop(state, bios, bdos)))
     await asyncio.gather(*tasks)
 
     print("Done: main()")
@@ -0,0 +1,320 @@
+"""
+Host side tooling for legacy CP/M disk images.
+
+Images on disk are in physical sector order, so sectors on the data tracks
+are interleaved by the format's skew. Drives mounted by cpm_core expect
+logical record order, so images are translated on the way in and out
+through precomputed per track tables.
+
+    python cpm_image.py formats
+    python cpm_image.py ls IMAGE --format ibm-3740
+    python cpm_image.py extract IMAGE DIR --format ibm-3740
+    python cpm_image.py convert SRC DST --from ibm-3740 --to runcpm-8mb [--logical]
+    python cpm_image.py bulk SRC_DIR DST_DIR --from ibm-3740 --to runcpm-8mb --jobs 8
+
+Formats other than the built-in ones are described in a JSON file, a list
+of objects shaped like the output of `formats --json`, and loaded with
+--formats FILE ahead of the command:
+
+    python cpm_image.py --formats kaypro.json ls IMAGE --format kaypro-ii
+"""
+from __future__ import annotations
+import argparse
+import concurrent.futures
+import dataclasses
+import fnmatch
+import functools
+import json
+import os
+import sys
+from typing import List, Optional, Iterable, Dict, Tuple
+
+from cpm_core import (DiskParameterBlock, DPB_IBM_3740, DPB_HD_8MB, RECORD_SIZE, EMPTY_BYTE, EOF_BYTE,
+                      MemoryDiskImage, CpmDisk, HostDisk, Disk, Fcb, BdosReturn)
+
+
+@functools.lru_cache(maxsize=None)
+def skew_table(sectors: int, skew: int) -> Tuple[int, ...]:
+    # logical sector -> physical sector, both 0 based, as built by a CP/M BIOS SECTRAN table
+    if skew <= 1:
+        return tuple(range(sectors))
+
+    table = []
+    used = [False] * sectors
+    position = 0
+    for _ in range(sectors):
+        while used[position]:
+            position = (position + 1) % sectors
+        table.append(position)
+        used[position] = True
+        position = (position + skew) % sectors
+    return tuple(table)
+
+
+@dataclasses.dataclass(frozen=True)
+class DiskFormat:
+    name: str
+    dpb: DiskParameterBlock
+    tracks: int
+    sector_size: int = RECORD_SIZE # physical sector size
+    skew: int = 0 # 0 or 1 means no interleave
+
+    @property
+    def sectors_per_track(self) -> int:
+        return self.dpb.spt * RECORD_SIZE // self.sector_size
+
+    @property
+    def track_size(self) -> int:
+        return self.dpb.spt * RECORD_SIZE
+
+    @property
+    def image_size(self) -> int:
+        return self.tracks * self.track_size
+
+    def skew_table(self) -> Tuple[int, ...]:
+        return skew_table(self.sectors_per_track, self.skew)
+
+    def _translate(self, data: bytes, to_logical: bool) -> bytearray:
+        size = self.image_size
+        source = memoryview(bytes(data[:size]).ljust(size, bytes([EMPTY_BYTE])))
+        if self.skew <= 1:
+            return bytearray(source)
+
+        result = bytearray(source)
+        table = self.skew_table()
+        sector = self.sector_size
+        # reserved tracks are read by the boot loader without translation
+        for track in range(self.dpb.off, self.tracks):
+            base = track * self.track_size
+            for logical, physical in enumerate(table):
+                logical_at = base + logical * sector
+                physical_at = base + physical * sector
+                if to_logical:
+                    result[logical_at:logical_at + sector] = source[physical_at:physical_at + sector]
+                else:
+                    result[physical_at:physical_at + sector] = source[logical_at:logical_at + sector]
+        return result
+
+    def to_logical(self, data: bytes) -> bytearray:
+        return self._translate(data, to_logical=True)
+
+    def to_physical(self, data: bytes) -> bytearray:
+        return self._translate(data, to_logical=False)
+
+    def to_dict(self) -> dict:
+        return dataclasses.asdict(self)
+
+    @classmethod
+    def from_dict(cls, value: dict) -> DiskFormat:
+        try:
+            fields = dict(value)
+            fields['dpb'] = DiskParameterBlock(**fields['dpb'])
+            return cls(**fields)
+        except (KeyError, TypeError) as err:
+            raise ValueError(f'Invalid format {value.get("name", "?")}: {err}')
+
+
+FORMATS: Dict[str, DiskFormat] = {}
+
+def register_format(disk_format: DiskFormat):
+    FORMATS[disk_format.name] = disk_format
+
+register_format(DiskFormat(name='ibm-3740', dpb=DPB_IBM_3740, tracks=77, skew=6))
+register_format(DiskFormat(name='runcpm-8mb', dpb=DPB_HD_8MB,
+                           tracks=DPB_HD_8MB.total_records // DPB_HD_8MB.spt))
+
+
+def load_formats(path: str) -> List[DiskFormat]:
+    # a JSON list of DiskFormat.to_dict() objects, registered for this run
+    with open(path) as file:
+        values = json.load(file)
+    formats = [DiskFormat.from_dict(value) for value in (values if isinstance(values, list) else [values])]
+    for disk_format in formats:
+        register_format(disk_format)
+    return formats
+
+
+def _mount_logical(data: bytearray, disk_format: DiskFormat) -> CpmDisk:
+    # the image may be shorter than the drive, pad to what the DPB addresses
+    total = disk_format.dpb.total_records * RECORD_SIZE
+    if len(data) < total:
+        data += bytes([EMPTY_BYTE]) * (total - len(data))
+    return CpmDisk(MemoryDiskImage(disk_format.dpb, data))
+
+
+def load_image(path: str, disk_format: DiskFormat) -> CpmDisk:
+    with open(path, 'rb') as file:
+        return _mount_logical(disk_format.to_logical(file.read()), disk_format)
+
+
+def blank_image(disk_format: DiskFormat) -> CpmDisk:
+    return CpmDisk(MemoryDiskImage(disk_format.dpb))
+
+
+def save_image(disk: CpmDisk, path: str, disk_format: DiskFormat, logical: bool = False):
+    # logical order skips the skew, as SharedBaseImage expects for an overlay base
+    disk.flush()
+    data = disk.image.read_records(0, disk_format.image_size // RECORD_SIZE)
+    with open(path, 'wb') as file:
+        file.write(data if logical else disk_format.to_physical(data))
+
+
+def list_files(disk: Disk) -> List[Tuple[int, bytes]]:
+    files = []
+    for user in range(16):
+        files.extend((user, entry.key) for entry in disk.search(user, b'?' * 11))
+    return files
+
+
+def _write_record(dst: Disk, fcb: Fcb, user: int, record: int, data):
+    if dst.write(fcb, user, record, data) != BdosReturn.OK:
+        raise OSError(f'Disk full writing {user}:{fcb.name.decode("ascii")}')
+
+
+def copy_files(src: Disk, dst: Disk) -> int:
+    # file level copy, so source and destination may use different DPBs
+    count = 0
+    for user, name in list_files(src):
+        fcb = Fcb()
+        fcb.data[1:12] = name
+        if dst.make(fcb, user) != BdosReturn.OK:
+            raise OSError(f'Unable to create {user}:{name.decode("ascii")}')
+
+        record = 0
+        pending = bytearray()
+        for chunk in src.read_file(user, name):
+            pending += chunk
+            whole = len(pending) - len(pending) % RECORD_SIZE
+            with memoryview(pending) as view:
+                for start in range(0, whole, RECORD_SIZE):
+                    _write_record(dst, fcb, user, record, view[start:start + RECORD_SIZE])
+                    record += 1
+            del pending[:whole]
+        if pending:
+            pending += bytes([EOF_BYTE]) * (RECORD_SIZE - len(pending))
+            _write_record(dst, fcb, user, record, pending)
+        dst.close(fcb, user)
+        count += 1
+    return count
+
+
+def convert(src_path: str, dst_path: str, src_format: DiskFormat, dst_format: DiskFormat,
+            logical: bool = False) -> int:
+    if src_format.dpb == dst_format.dpb:
+        # same file system, only the sector layout changes
+        with open(src_path, 'rb') as file:
+            data = src_format.to_logical(file.read())
+        with open(dst_path, 'wb') as file:
+            file.write(data if logical else dst_format.to_physical(data))
+        return len(list_files(_mount_logical(data, src_format)))
+
+    src = load_image(src_path, src_format)
+    dst = blank_image(dst_format)
+    count = copy_files(src, dst)
+    save_image(dst, dst_path, dst_format, logical)
+    return count
+
+
+def _convert_job(job: Tuple[str, str, DiskFormat, DiskFormat, bool]) -> Tuple[str, Optional[int], Optional[str]]:
+    src_path, dst_path, src_format, dst_format, logical = job
+    try:
+        return src_path, convert(src_path, dst_path, src_format, dst_format, logical), None
+    except Exception as err:
+        return src_path, None, str(err)
+
+
+def bulk_convert(paths: Iterable[str], dst_dir: str, src_format: DiskFormat, dst_format: DiskFormat,
+                 jobs: Optional[int] = None, logical: bool = False) -> List[Tuple[str, Optional[int], Optional[str]]]:
+    """
+    Convert many images across a process pool. Formats are pickled into
+    each job, so ones loaded from a format file reach the workers too.
+    Returns (source path, files copied, error) per image.
+    """
+    work = [(path, os.path.join(dst_dir, os.path.basename(path)), src_format, dst_format, logical)
+            for path in paths]
+    for src_path, dst_path, *_ in work:
+        if os.path.realpath(src_path) == os.path.realpath(dst_path):
+            raise ValueError(f'{dst_path} would overwrite its source, use a different destination')
+    os.makedirs(dst_dir, exist_ok=True)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(_convert_job, work))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    # format files are loaded first so their names are valid choices below
+    formats = argparse.ArgumentParser(add_help=False)
+    formats.add_argument('--formats', action='append', default=[], metavar='FILE',
+                         help='JSON file of extra disk formats, may be repeated')
+    known, _ = formats.parse_known_args(argv)
+    for path in known.formats:
+        load_formats(path)
+
+    parser = argparse.ArgumentParser(description='CP/M disk image tool', parents=[formats])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    listing = commands.add_parser('formats')
+    listing.add_argument('--json', action='store_true', help='print as a format file')
+
+    ls = commands.add_parser('ls')
+    ls.add_argument('image')
+    ls.add_argument('--format', default='ibm-3740', choices=FORMATS)
+
+    extract = commands.add_parser('extract')
+    extract.add_argument('image')
+    extract.add_argument('directory')
+    extract.add_argument('--format', default='ibm-3740', choices=FORMATS)
+
+    single = commands.add_parser('convert')
+    single.add_argument('src')
+    single.add_argument('dst')
+    single.add_argument('--from', dest='src_format', default='ibm-3740', choices=FORMATS)
+    single.add_argument('--to', dest='dst_format', default='runcpm-8mb', choices=FORMATS)
+    single.add_argument('--logical', action='store_true', help='unskewed record order, for an overlay base')
+
+    bulk = commands.add_parser('bulk')
+    bulk.add_argument('src_dir')
+    bulk.add_argument('dst_dir')
+    bulk.add_argument('--from', dest='src_format', default='ibm-3740', choices=FORMATS)
+    bulk.add_argument('--to', dest='dst_format', default='runcpm-8mb', choices=FORMATS)
+    bulk.add_argument('--pattern', default='*')
+    bulk.add_argument('--jobs', type=int, default=None)
+    bulk.add_argument('--logical', action='store_true', help='unskewed record order, for an overlay base')
+
+    args = parser.parse_args(argv)
+    if args.command == 'formats' and args.json:
+        print(json.dumps([disk_format.to_dict() for disk_format in FORMATS.values()], indent=2))
+    elif args.command == 'formats':
+        for disk_format in FORMATS.values():
+            print(f'{disk_format.name:<12} {disk_format.image_size:>9} bytes  '
+                  f'{disk_format.sectors_per_track} x {disk_format.sector_size}B sectors  skew {disk_format.skew}')
+    elif args.command == 'ls':
+        for user, name in list_files(load_image(args.image, FORMATS[args.format])):
+            print(f'{user:>2}: {name[:8].decode("ascii").rstrip()}.{name[8:].decode("ascii").rstrip()}')
+    elif args.command == 'extract':
+        count = copy_files(load_image(args.image, FORMATS[args.format]), HostDisk(args.directory))
+        print(f'{count} files')
+    elif args.command == 'convert':
+        count = convert(args.src, args.dst, FORMATS[args.src_format], FORMATS[args.dst_format], args.logical)
+        print(f'{count} files')
+    elif args.command == 'bulk':
+        paths = sorted(os.path.join(args.src_dir, name) for name in os.listdir(args.src_dir)
+                       if fnmatch.fnmatch(name, args.pattern) and os.path.isfile(os.path.join(args.src_dir, name)))
+        failed = 0
+        try:
+            results = bulk_convert(paths, args.dst_dir, FORMATS[args.src_format], FORMATS[args.dst_format],
+                                   jobs=args.jobs, logical=args.logical)
+        except ValueError as err:
+            print(err, file=sys.stderr)
+            return 2
+        for path, count, error in results:
+            if error is None:
+                print(f'{path}: {count} files')
+            else:
+                failed += 1
+                print(f'{path}: {error}', file=sys.stderr)
+        return 1 if failed else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
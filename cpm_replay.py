@@ -0,0 +1,171 @@
+"""
+Record console sessions and replay them against the current build.
+
+A recording is a JSON lines log of timestamped console input and BDOS
+calls. Replaying feeds the input back through Bios, either as fast as the
+CCP will take it or with the think time of the original session, and
+reports the end to end latency of every command.
+
+    python cpm_replay.py record session.jsonl
+    python cpm_replay.py replay session.jsonl [--timing original] [--image IMG --format ibm-3740]
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import collections
+import dataclasses
+import json
+import sys
+import time
+from typing import List, Optional, Dict, Callable, Awaitable
+
+from cpm_core import Bios, Bdos, BdosOpcode, BdosReturn, CcpOpcode, DiskDrive, Fcb, ccp_loop, create_session
+
+
+class SessionRecorder:
+    def __init__(self, path: str):
+        self._file = open(path, 'w')
+        self._start = time.perf_counter()
+        self._reader: Optional[Callable[[str], Awaitable[str]]] = None
+        self._bios: Optional[Bios] = None
+
+    def attach(self, bios: Bios, bdos: Bdos):
+        self._bios = bios
+        self._reader = bios._reader
+        bios.set_reader(self._read)
+        bdos.trace = self._trace
+
+    def _log(self, event: dict):
+        event['t'] = round(time.perf_counter() - self._start, 6)
+        self._file.write(json.dumps(event) + '\n')
+
+    async def _read(self, prompt: str) -> str:
+        shown = time.perf_counter()
+        command = self._bios.reading_command
+        value = await self._reader(prompt)
+        # command is False for answers to a built-in's prompt, e.g. ALL (Y/N)?
+        self._log({'kind': 'input', 'prompt': prompt, 'value': value, 'command': command,
+                   'wait': round(time.perf_counter() - shown, 6)})
+        return value
+
+    def _trace(self, opcode: BdosOpcode, arg, result: BdosReturn):
+        event = {'kind': 'bdos', 'op': opcode.value, 'result': int(result)}
+        if isinstance(arg, Fcb):
+            event['name'] = arg.name.decode('ascii', 'replace')
+        self._log(event)
+
+    def close(self):
+        self._file.close()
+
+
+@dataclasses.dataclass
+class CommandTiming:
+    value: str
+    seconds: float
+
+
+class SessionReplayer:
+    def __init__(self, events: List[dict], original_timing: bool = False):
+        self.original_timing = original_timing
+        self._inputs = [event for event in events if event['kind'] == 'input']
+        self._expected = collections.Counter(event['op'] for event in events if event['kind'] == 'bdos')
+        self._replayed: Dict[str, int] = collections.Counter()
+        self._index = 0
+        self._pending: Optional[CommandTiming] = None
+        self._bios: Optional[Bios] = None
+        self.timings: List[CommandTiming] = []
+        self.elapsed = 0.0
+
+    @classmethod
+    def load(cls, path: str, original_timing: bool = False) -> SessionReplayer:
+        with open(path) as file:
+            return cls([json.loads(line) for line in file if line.strip()], original_timing)
+
+    def attach(self, bios: Bios, bdos: Bdos):
+        self._bios = bios
+        bios.set_reader(self._read)
+        bdos.trace = self._trace
+
+    async def _read(self, prompt: str) -> str:
+        # a command runs from its get_input to the next one, prompts inside it included
+        command = self._bios.reading_command
+        now = time.perf_counter()
+        if command and self._pending is not None:
+            self._pending.seconds = now - self._pending.seconds
+            self.timings.append(self._pending)
+            self._pending = None
+
+        if self._index >= len(self._inputs):
+            return str(CcpOpcode.EXIT) if command else ''
+
+        event = self._inputs[self._index]
+        self._index += 1
+        if self.original_timing:
+            await asyncio.sleep(event.get('wait', 0))
+        if command:
+            self._pending = CommandTiming(value=event['value'], seconds=time.perf_counter())
+        return event['value']
+
+    def _trace(self, opcode: BdosOpcode, arg, result: BdosReturn):
+        self._replayed[opcode.value] += 1
+
+    async def run(self, state, bios: Bios, bdos: Bdos):
+        self.attach(bios, bdos)
+        start = time.perf_counter()
+        await ccp_loop(state, bios, bdos)
+        self.elapsed = time.perf_counter() - start
+
+    def report(self) -> List[str]:
+        lines = []
+        for timing in self.timings:
+            lines.append(f'{timing.seconds * 1e3:9.3f} ms  {timing.value}')
+
+        if self.timings:
+            ordered = sorted(timing.seconds for timing in self.timings)
+            p50 = ordered[len(ordered) // 2]
+            p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+            lines.append(f'{len(ordered)} commands in {self.elapsed:.3f}s  '
+                         f'p50 {p50 * 1e3:.3f} ms  p95 {p95 * 1e3:.3f} ms  max {ordered[-1] * 1e3:.3f} ms')
+
+        if self._inputs and not self._expected:
+            lines.append('Recording has no BDOS events, only command latency can be compared')
+        for op in sorted(set(self._expected) | set(self._replayed)):
+            if self._expected[op] != self._replayed[op]:
+                lines.append(f'BDOS {op}: recorded {self._expected[op]} replayed {self._replayed[op]}')
+        return lines
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Record or replay a CP/M console session')
+    parser.add_argument('command', choices=['record', 'replay'])
+    parser.add_argument('log')
+    parser.add_argument('--timing', choices=['fast', 'original'], default='fast')
+    parser.add_argument('--image', help='image to mount on A: instead of a blank drive')
+    parser.add_argument('--format', default='ibm-3740')
+    parser.add_argument('--verbose', action='store_true', help='show console output while replaying')
+    args = parser.parse_args(argv)
+
+    state, bios, bdos = create_session()
+    if args.image:
+        from cpm_image import FORMATS, load_image
+        bdos.mount(DiskDrive.A, load_image(args.image, FORMATS[args.format]))
+
+    if args.command == 'record':
+        recorder = SessionRecorder(args.log)
+        recorder.attach(bios, bdos)
+        try:
+            asyncio.run(ccp_loop(state, bios, bdos))
+        finally:
+            recorder.close()
+        return 0
+
+    replayer = SessionReplayer.load(args.log, original_timing=args.timing == 'original')
+    if not args.verbose:
+        bios.set_printer(None)
+    asyncio.run(replayer.run(state, bios, bdos))
+    print('\n'.join(replayer.report()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
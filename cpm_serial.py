@@ -0,0 +1,184 @@
+"""
+USB serial bridge between a host cpm_core session and the KB2040.
+
+Console output goes to the board's CpmScreen and LED state to its TLC5940;
+the board sends key presses back. Everything queued during one frame
+interval goes out as a single framed write, see KB_LED/cpm_link.py.
+
+    python cpm_serial.py /dev/ttyACM1
+
+The board needs the USB CDC data port enabled, see KB_LED/boot.py.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import os
+import sys
+from typing import List, Optional, Callable
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'KB_LED'))
+import cpm_link
+
+from cpm_core import Bios, BiosDevice, BiosWriteDest, DeviceOverflow, ccp_loop, create_session
+
+LED_DEVICE = 'leds'
+BACKSPACE = set([0x08, 0x7F])
+
+
+class LoopbackTransport:
+    """In process stand-in for the USB CDC data port, for testing without a board."""
+    def __init__(self):
+        self._inbox = bytearray()
+        self.peer: Optional[LoopbackTransport] = None
+        self.writes = 0
+
+    @classmethod
+    def pair(cls) -> tuple:
+        host, board = cls(), cls()
+        host.peer, board.peer = board, host
+        return host, board
+
+    def write(self, data: bytes):
+        self.writes += 1
+        self.peer._inbox.extend(data)
+
+    def read(self) -> bytes:
+        data = bytes(self._inbox)
+        self._inbox.clear()
+        return data
+
+    def close(self):
+        pass
+
+
+class SerialTransport:
+    def __init__(self, port: str, baudrate: int = 115200):
+        try:
+            import serial
+        except ImportError:
+            raise ImportError('pyserial is required to talk to the board: pip install pyserial')
+        self._serial = serial.Serial(port, baudrate, timeout=0)
+        self.writes = 0
+
+    def write(self, data: bytes):
+        self.writes += 1
+        self._serial.write(data)
+
+    def read(self) -> bytes:
+        return self._serial.read(self._serial.in_waiting or 1)
+
+    def close(self):
+        self._serial.close()
+
+
+class BridgeDevice(BiosDevice):
+    def __init__(self, name: str, bridge: SerialBridge, msg_type: int, encode: Callable[[object], bytes], **kwargs):
+        super().__init__(name, **kwargs)
+        self._bridge = bridge
+        self._msg_type = msg_type
+        self._encode = encode
+
+    async def handle(self, item):
+        self._bridge.queue(self._msg_type, self._encode(item))
+
+
+class SerialBridge:
+    def __init__(self, transport, frame_interval: float = 1 / 30, max_payload: int = cpm_link.MAX_PAYLOAD):
+        self._transport = transport
+        self.frame_interval = frame_interval
+        self._max_payload = max_payload
+        self._encoder = cpm_link.FrameEncoder(max_payload)
+        self._decoder = cpm_link.FrameDecoder(max_payload)
+        self._keys: asyncio.Queue = asyncio.Queue()
+        self._bios: Optional[Bios] = None
+        self.frames_sent = 0
+
+    def attach(self, bios: Bios):
+        self._bios = bios
+        devices = bios.devices
+        devices.register(BridgeDevice(BiosWriteDest.DISPLAY.device_name, self, cpm_link.MSG_CONSOLE,
+                                      lambda item: str(item).encode('ascii', 'replace'), maxsize=256))
+        # only the latest LED state matters, console output must not be lost
+        devices.register(BridgeDevice(LED_DEVICE, self, cpm_link.MSG_LED, cpm_link.pack_leds, maxsize=4,
+                                      overflow=DeviceOverflow.DROP_OLDEST))
+        bios.set_reader(self.read_line)
+
+    def queue(self, msg_type: int, data: bytes):
+        self._encoder.add(msg_type, data)
+        if self._encoder.pending() >= self._max_payload:
+            self.flush()
+
+    def flush(self):
+        for frame in self._encoder.frames():
+            self._transport.write(frame)
+            self.frames_sent += 1
+
+    def poll(self):
+        data = self._transport.read()
+        if not data:
+            return
+        for msg_type, payload in self._decoder.feed(data):
+            if msg_type == cpm_link.MSG_KEY:
+                for key in payload:
+                    self._keys.put_nowait(key)
+
+    async def run(self):
+        while True:
+            self.poll()
+            self.flush()
+            await asyncio.sleep(self.frame_interval)
+
+    async def read_key(self) -> int:
+        return await self._keys.get()
+
+    async def _echo(self, text: str):
+        # through the display device, so it stays in order with console output
+        await self._bios.devices.put(BiosWriteDest.DISPLAY.device_name, text)
+
+    async def read_line(self, prompt: str) -> str:
+        # line editing happens here, the board only forwards raw keys
+        await self._echo(prompt)
+        line: List[str] = []
+        while True:
+            key = await self.read_key()
+            if key in (0x0D, 0x0A):
+                await self._echo('\n')
+                return ''.join(line)
+            if key in BACKSPACE:
+                if line:
+                    line.pop()
+                    await self._echo('\x08 \x08')
+                continue
+            line.append(chr(key))
+            await self._echo(chr(key))
+
+
+async def run_session(transport, frame_interval: float):
+    state, bios, bdos = create_session()
+    bridge = SerialBridge(transport, frame_interval=frame_interval)
+    bridge.attach(bios)
+    pump = asyncio.create_task(bridge.run())
+    try:
+        await ccp_loop(state, bios, bdos)
+        bridge.flush()
+    finally:
+        pump.cancel()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Run a CP/M session on the KB2040 over USB serial')
+    parser.add_argument('port')
+    parser.add_argument('--baudrate', type=int, default=115200)
+    parser.add_argument('--fps', type=float, default=30)
+    args = parser.parse_args(argv)
+
+    transport = SerialTransport(args.port, args.baudrate)
+    try:
+        asyncio.run(run_session(transport, 1 / args.fps))
+    finally:
+        transport.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
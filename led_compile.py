@@ -0,0 +1,84 @@
+"""
+Compile LED animations into ready to send TLC5940 grayscale frames.
+
+Input is a sequence of frames of 16 x 12 bit channel values, as a .npy
+array of shape (frames, 16) or a CSV with one frame per line. Output is a
+KB_LED/led_anim.py stream: a header followed by packed 24 byte GS frames
+that TLC5940.play writes straight to SPI.
+
+    python led_compile.py animation.csv animation.tlc --fps 60
+"""
+from __future__ import annotations
+import argparse
+import os
+import sys
+from typing import List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'KB_LED'))
+import led_anim
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def pack_frames(frames) -> bytes:
+    """
+    Vectorized equivalent of tlc5940.gs_data_to_bytes over every frame:
+    each pair of 12 bit values (a, b) becomes the bytes
+        a[11:4], a[3:0] b[11:8], b[7:0]
+    """
+    if np is None:
+        raise ImportError('numpy is required to compile animations: pip install numpy')
+
+    frames = np.asarray(frames, dtype=np.uint16)
+    if frames.ndim != 2 or frames.shape[1] != led_anim.CHANNELS:
+        raise ValueError(f'Frames must have shape (n, {led_anim.CHANNELS}), got {frames.shape}')
+
+    frames = frames & 0xFFF
+    first = frames[:, 0::2]
+    second = frames[:, 1::2]
+    packed = np.empty(first.shape + (3,), dtype=np.uint8)
+    packed[..., 0] = first >> 4
+    packed[..., 1] = ((first & 0x0F) << 4) | (second >> 8)
+    packed[..., 2] = second & 0xFF
+    return packed.tobytes()
+
+
+def compile_animation(frames, fps: int) -> bytes:
+    data = pack_frames(frames)
+    return led_anim.pack_header(fps, len(data) // led_anim.FRAME_SIZE) + data
+
+
+def load_frames(path: str):
+    if np is None:
+        raise ImportError('numpy is required to compile animations: pip install numpy')
+    if path.endswith('.npy'):
+        return np.load(path)
+    return np.loadtxt(path, delimiter=',', dtype=np.uint16, ndmin=2)
+
+
+def frame_rate(value: str) -> int:
+    fps = int(value)
+    if not 1 <= fps <= led_anim.MAX_FPS:
+        raise argparse.ArgumentTypeError(f'fps must be between 1 and {led_anim.MAX_FPS}')
+    return fps
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Compile an LED animation for TLC5940.play')
+    parser.add_argument('src', help='.npy or .csv, one frame of 16 values per row')
+    parser.add_argument('dst')
+    parser.add_argument('--fps', type=frame_rate, default=30)
+    args = parser.parse_args(argv)
+
+    data = compile_animation(load_frames(args.src), args.fps)
+    with open(args.dst, 'wb') as file:
+        file.write(data)
+    print(f'{(len(data) - led_anim.HEADER_SIZE) // led_anim.FRAME_SIZE} frames, {len(data)} bytes')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
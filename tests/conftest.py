@@ -0,0 +1,29 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cpm_core import ccp_loop, create_session
+
+
+def run_session(*commands):
+    state, bios, bdos = create_session()
+    out = []
+    bios.set_printer(out.append)
+    lines = iter(list(commands) + ['exit'])
+
+    async def reader(prompt):
+        return next(lines)
+
+    bios.set_reader(reader)
+    asyncio.run(ccp_loop(state, bios, bdos))
+    return ''.join(out), state, bios, bdos
+
+
+@pytest.fixture
+def session():
+    # runs commands through the CCP, returns (console, state, bios, bdos)
+    return run_session
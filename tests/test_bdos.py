@@ -0,0 +1,144 @@
+import pytest
+
+from cpm_core import (BdosOpcode, BdosReturn, CpmDisk, DEFAULT_DMA, Disk, DiskDrive, DiskImage, DPB_HD_8MB,
+                      DPB_IBM_3740, MEMORY_SIZE, MemoryDiskImage, RECORDS_PER_EXTENT, RECORD_SIZE, create_session)
+
+FCB_ADDRESS = 0x005C
+NAME = b'TEST    DAT'
+
+
+@pytest.fixture(params=[DPB_IBM_3740, DPB_HD_8MB], ids=['ibm-3740', 'hd-8mb'])
+def bdos(request):
+    state, bios, bdos = create_session()
+    bdos.mount(DiskDrive.A, CpmDisk(MemoryDiskImage(request.param)))
+    return bdos
+
+
+@pytest.fixture(params=[DPB_IBM_3740, DPB_HD_8MB], ids=['ibm-3740', 'hd-8mb'])
+def dpb(request):
+    return request.param
+
+
+def new_fcb(bdos):
+    fcb = bdos.fcb_at(FCB_ADDRESS)
+    fcb.data[:] = bytes(len(fcb.data))
+    fcb.data[1:12] = NAME
+    return fcb
+
+
+def record_data(record: int) -> bytes:
+    return bytes((record + offset) & 0xFF for offset in range(RECORD_SIZE))
+
+
+def test_sequential_round_trip_across_extent(bdos):
+    count = RECORDS_PER_EXTENT + 3
+    fcb = new_fcb(bdos)
+    assert bdos.call(BdosOpcode.MAKE, fcb) == BdosReturn.OK
+    for record in range(count):
+        bdos.dma[:] = record_data(record)
+        assert bdos.call(BdosOpcode.WRITE, fcb) == BdosReturn.OK
+    assert bdos.call(BdosOpcode.CLOSE, fcb) == BdosReturn.OK
+
+    fcb = new_fcb(bdos)
+    assert bdos.call(BdosOpcode.OPEN, fcb) == BdosReturn.OK
+    for record in range(count):
+        assert bdos.call(BdosOpcode.READ, fcb) == BdosReturn.OK
+        assert bytes(bdos.dma) == record_data(record)
+    assert bdos.call(BdosOpcode.READ, fcb) == BdosReturn.EOF
+
+
+def test_random_round_trip_across_extent(bdos):
+    records = [0, RECORDS_PER_EXTENT - 1, RECORDS_PER_EXTENT, 2 * RECORDS_PER_EXTENT + 5]
+    fcb = new_fcb(bdos)
+    assert bdos.call(BdosOpcode.MAKE, fcb) == BdosReturn.OK
+    for record in reversed(records):
+        fcb.random_record = record
+        bdos.dma[:] = record_data(record)
+        assert bdos.call(BdosOpcode.WRITE_RANDOM, fcb) == BdosReturn.OK
+    assert bdos.call(BdosOpcode.CLOSE, fcb) == BdosReturn.OK
+
+    fcb = new_fcb(bdos)
+    assert bdos.call(BdosOpcode.OPEN, fcb) == BdosReturn.OK
+    for record in records:
+        fcb.random_record = record
+        assert bdos.call(BdosOpcode.READ_RANDOM, fcb) == BdosReturn.OK
+        assert bytes(bdos.dma) == record_data(record)
+
+    # sequential reads carry on from the last random read
+    assert bdos.call(BdosOpcode.READ, fcb) == BdosReturn.OK
+    assert bytes(bdos.dma) == record_data(records[-1])
+
+    fcb.random_record = 0x10000
+    assert bdos.call(BdosOpcode.READ_RANDOM, fcb) == BdosReturn.OUT_OF_RANGE
+
+
+def test_sequential_io_is_batched(dpb):
+    # per record I/O would cost one image operation per record
+    count = 1500
+    blocks = count // dpb.records_per_block
+    state, bios, bdos = create_session()
+    image = MemoryDiskImage(dpb)
+    bdos.mount(DiskDrive.A, CpmDisk(image))
+
+    fcb = new_fcb(bdos)
+    assert bdos.call(BdosOpcode.MAKE, fcb) == BdosReturn.OK
+    for record in range(count):
+        bdos.dma[:] = record_data(record)
+        assert bdos.call(BdosOpcode.WRITE, fcb) == BdosReturn.OK
+    assert bdos.call(BdosOpcode.CLOSE, fcb) == BdosReturn.OK
+    assert image.write_ops <= blocks // 4
+
+    # remount so the reads start from a cold cache
+    bdos.mount(DiskDrive.A, CpmDisk(image))
+    reads = image.read_ops
+    fcb = new_fcb(bdos)
+    assert bdos.call(BdosOpcode.OPEN, fcb) == BdosReturn.OK
+    for record in range(count):
+        assert bdos.call(BdosOpcode.READ, fcb) == BdosReturn.OK
+    assert image.read_ops - reads <= blocks // 4
+
+
+def test_set_dma_bounds():
+    state, bios, bdos = create_session()
+    assert bdos.dma_address == DEFAULT_DMA
+    for address in (-1, MEMORY_SIZE - RECORD_SIZE + 1, MEMORY_SIZE):
+        assert bdos.call(BdosOpcode.SET_DMA, address) == BdosReturn.ERROR
+        assert bdos.dma_address == DEFAULT_DMA
+    for address in (0, MEMORY_SIZE - RECORD_SIZE):
+        assert bdos.call(BdosOpcode.SET_DMA, address) == BdosReturn.OK
+        assert bdos.dma_address == address
+        assert len(bdos.dma) == RECORD_SIZE
+
+
+def test_records_move_through_memory_at_the_dma_address():
+    state, bios, bdos = create_session()
+    address = 0x4000
+    state.memory[address:address + RECORD_SIZE] = record_data(7)
+    assert bdos.call(BdosOpcode.SET_DMA, address) == BdosReturn.OK
+    fcb = new_fcb(bdos)
+    assert bdos.call(BdosOpcode.MAKE, fcb) == BdosReturn.OK
+    assert bdos.call(BdosOpcode.WRITE, fcb) == BdosReturn.OK
+    assert bdos.call(BdosOpcode.CLOSE, fcb) == BdosReturn.OK
+
+    address = 0x2000
+    assert bdos.call(BdosOpcode.SET_DMA, address) == BdosReturn.OK
+    fcb = new_fcb(bdos)
+    assert bdos.call(BdosOpcode.OPEN, fcb) == BdosReturn.OK
+    assert bdos.call(BdosOpcode.READ, fcb) == BdosReturn.OK
+    assert state.memory[address:address + RECORD_SIZE] == record_data(7)
+    assert not any(state.memory[address - RECORD_SIZE:address])
+    assert not any(state.memory[address + RECORD_SIZE:address + 2 * RECORD_SIZE])
+    assert not any(state.memory[DEFAULT_DMA:DEFAULT_DMA + RECORD_SIZE])
+
+
+def test_incomplete_subclasses_fail_at_construction():
+    class PartialDisk(Disk):
+        pass
+
+    class PartialImage(DiskImage):
+        pass
+
+    with pytest.raises(TypeError):
+        PartialDisk()
+    with pytest.raises(TypeError):
+        PartialImage(DPB_IBM_3740)
@@ -0,0 +1,9 @@
+def test_invalid_filespecs_are_rejected(session):
+    console, *_ = session('save 1', 'save 1 .com', 'save 1 a/b', 'type', 'dir é', 'ren x.com=', 'era a<b')
+    assert console.count('Invalid filespec.') == 7
+    assert 'NO FILE' not in console
+
+
+def test_dir_without_a_name_lists_everything(session):
+    console, *_ = session('save 1 foo.com', 'dir', 'dir a:', 'dir *.com')
+    assert console.count('A: FOO      COM') == 3
@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from cpm_core import BiosDevice, BiosWriteDest, CcpMessage, DeviceOverflow, ccp_loop, create_session
+
+
+class SlowDevice(BiosDevice):
+    def __init__(self, name, **kwargs):
+        super().__init__(name, **kwargs)
+        self.items = []
+
+    async def handle(self, item):
+        await asyncio.sleep(0)
+        self.items.append(item)
+
+
+def run_with_devices(bios, body):
+    async def main():
+        bios.devices.start()
+        await body()
+        await bios.devices.stop()
+    asyncio.run(main())
+
+
+def test_stream_waits_for_display_instead_of_dropping():
+    state, bios, bdos = create_session()
+    bios.set_printer(None)
+    display = SlowDevice(BiosWriteDest.DISPLAY.device_name, maxsize=2)
+    bios.devices.register(display)
+    chunks = [f'line {index}\n'.encode() for index in range(500)]
+
+    run_with_devices(bios, lambda: bios.stream(chunks))
+
+    assert display.dropped == 0
+    assert ''.join(display.items) == b''.join(chunks).decode()
+
+
+def test_list_output_is_lossless_by_default():
+    state, bios, bdos = create_session()
+    printer = SlowDevice(BiosWriteDest.LIST.device_name, maxsize=1)
+    bios.devices.register(printer)
+
+    async def body():
+        for index in range(100):
+            await bios.write(CcpMessage(f'{index}'), BiosWriteDest.LIST)
+
+    run_with_devices(bios, body)
+    assert printer.items == [f'{index}\n' for index in range(100)]
+
+
+def test_drop_oldest_keeps_latest_state():
+    device = SlowDevice('leds', maxsize=2, overflow=DeviceOverflow.DROP_OLDEST)
+
+    async def main():
+        task = asyncio.ensure_future(device.run())
+        for index in range(10):
+            device.offer(index)
+        await device.drain()
+        task.cancel()
+
+    asyncio.run(main())
+    assert device.items == [8, 9]
+    assert device.dropped == 8
+
+
+class HungDevice(BiosDevice):
+    async def handle(self, item):
+        await asyncio.Event().wait()
+
+
+def test_hung_display_never_blocks_the_ccp():
+    state, bios, bdos = create_session()
+    bios.set_printer(None)
+    display = HungDevice(BiosWriteDest.DISPLAY.device_name, maxsize=2, put_timeout=0.05)
+    bios.devices.register(display)
+    lines = iter(['dir'] * 20 + ['exit'])
+
+    async def reader(prompt):
+        return next(lines)
+
+    bios.set_reader(reader)
+    asyncio.run(asyncio.wait_for(ccp_loop(state, bios, bdos), timeout=5))
+    assert display.stalled
+    assert display.dropped > 0
+
+
+def test_cancelled_session_skips_draining():
+    state, bios, bdos = create_session()
+    bios.set_printer(None)
+    bios.devices.register(HungDevice(BiosWriteDest.DISPLAY.device_name, maxsize=1, put_timeout=None))
+
+    async def reader(prompt):
+        await asyncio.Event().wait()
+
+    bios.set_reader(reader)
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(asyncio.wait_for(ccp_loop(state, bios, bdos), timeout=0.2))
@@ -0,0 +1,75 @@
+import json
+
+from cpm_core import CcpMessage, EventKind, EventLog
+
+
+def fill(log, count):
+    for seq in range(count):
+        kind = EventKind.ERROR if seq % 2 else EventKind.EVENT
+        log.log(kind, 'test', CcpMessage(f'message {seq}'))
+
+
+def messages(records):
+    return [record.message.entries[0] for record in records]
+
+
+def test_ring_wraps_around():
+    log = EventLog(capacity=4)
+    fill(log, 10)
+    assert len(log) == 4
+    assert log.total == 10
+    assert [record.seq for record in log.records()] == [9, 8, 7, 6]
+    assert messages(log.records(EventKind.ERROR)) == ['message 9', 'message 7']
+
+
+def test_recent_and_last():
+    log = EventLog(capacity=4)
+    assert log.last() is None
+    assert log.recent(3) == []
+    fill(log, 6)
+    assert messages(log.recent(2)) == ['message 5', 'message 4']
+    assert messages(log.recent(10)) == ['message 5', 'message 4', 'message 3', 'message 2']
+    assert messages(log.recent(1, EventKind.EVENT)) == ['message 4']
+    assert log.last().seq == 5
+    assert log.last(EventKind.ERROR).seq == 5
+    assert log.last(EventKind.EVENT).seq == 4
+
+
+def test_export_is_oldest_first():
+    log = EventLog(capacity=3)
+    fill(log, 5)
+    exported = log.export()
+    assert [record['seq'] for record in exported] == [2, 3, 4]
+    assert exported[0] == {
+        'seq': 2,
+        'timestamp': exported[0]['timestamp'],
+        'kind': 'event',
+        'source': 'test',
+        'message': ['message 2'],
+    }
+    assert json.loads(log.to_json()) == exported
+
+    log.clear()
+    assert len(log) == 0
+    assert log.export() == []
+
+
+def test_err_builtin(session):
+    console, state, *_ = session('err', 'foo', 'b:', 'err', 'err 1', 'err all', 'err bogus')
+    lines = console.splitlines()
+    assert 'No error logged.' in lines
+    assert lines.count('B:?') == 2
+    assert lines.count('   2 error ccp: B:?') == 2
+    assert lines.count('   1 error ccp: FOO?') == 1
+    assert lines.count('   0 event bdos: Mounted CpmDisk on A:') == 1
+    assert 'BOGUS?' in lines
+
+
+def test_err_json(session, tmp_path):
+    path = tmp_path / 'events.json'
+    console, state, *_ = session('foo', f'err json {path}', 'err json')
+    saved = json.loads(path.read_text())
+    assert [record['kind'] for record in saved] == ['event', 'error']
+    assert saved[-1]['message'] == ['FOO?']
+    printed = console[console.index('['):console.rindex(']') + 1]
+    assert json.loads(printed) == saved
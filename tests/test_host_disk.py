@@ -0,0 +1,79 @@
+import os
+
+from cpm_core import BdosReturn, Fcb, HostDisk
+
+NEW = b'NEW     TXT'
+HELLO = b'HELLO   TXT'
+ALL = b'?' * 11
+
+
+def make_file(disk, name, user=0):
+    fcb = Fcb()
+    fcb.data[1:12] = name
+    assert disk.make(fcb, user) == BdosReturn.OK
+    disk.close(fcb, user)
+
+
+def test_rename_onto_existing_file_is_refused(tmp_path):
+    os.makedirs(tmp_path / '0')
+    (tmp_path / '0' / 'hello.txt').write_bytes(b'keep')
+    disk = HostDisk(str(tmp_path))
+    make_file(disk, NEW)
+
+    assert disk.rename(0, NEW, HELLO) == 0
+    assert (tmp_path / '0' / 'hello.txt').read_bytes() == b'keep'
+    assert sorted(entry.key for entry in disk.search(0, ALL)) == [HELLO, NEW]
+
+    assert disk.delete(0, ALL) == 2
+    assert os.listdir(tmp_path / '0') == []
+
+
+def test_rename_updates_listing(tmp_path):
+    disk = HostDisk(str(tmp_path))
+    make_file(disk, NEW)
+    assert disk.rename(0, NEW, HELLO) == 1
+    assert [entry.key for entry in disk.search(0, ALL)] == [HELLO]
+    assert os.listdir(tmp_path / '0') == ['HELLO.TXT']
+
+
+def test_names_that_escape_the_drive_are_refused(tmp_path):
+    root = tmp_path / 'drive'
+    disk = HostDisk(str(root))
+    for name in [b'/TMP/ESC   ', b'SUB/X      ', b'..         ', b'        COM']:
+        fcb = Fcb()
+        fcb.data[1:12] = name
+        assert disk.make(fcb, 0) == BdosReturn.ERROR
+
+    make_file(disk, NEW)
+    assert disk.rename(0, NEW, b'../X       ') == 0
+    assert os.listdir(tmp_path) == ['drive']
+    assert os.listdir(root / '0') == ['NEW.TXT']
+
+
+def test_host_errors_become_bdos_errors(tmp_path):
+    (tmp_path / 'drive').write_bytes(b'not a directory')
+    fcb = Fcb()
+    fcb.data[1:12] = NEW
+    assert HostDisk(str(tmp_path / 'drive')).make(fcb, 0) == BdosReturn.ERROR
+
+
+def test_listing_is_cached_until_the_directory_changes(tmp_path):
+    disk = HostDisk(str(tmp_path))
+    make_file(disk, NEW)
+    disk.invalidate()
+
+    disk.search(0, ALL)
+    scans = disk.scans
+    for _ in range(5):
+        assert [entry.key for entry in disk.search(0, ALL)] == [NEW]
+    assert disk.scans == scans
+    assert disk.listing_hits >= 5
+
+    # a file created behind the drive's back; bump the mtime past the clock granularity
+    user_dir = tmp_path / '0'
+    (user_dir / 'hello.txt').write_bytes(b'hi')
+    stat = os.stat(user_dir)
+    os.utime(user_dir, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    assert sorted(entry.key for entry in disk.search(0, ALL)) == [HELLO, NEW]
+    assert disk.scans == scans + 1
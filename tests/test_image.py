@@ -0,0 +1,76 @@
+import dataclasses
+import json
+import os
+
+import pytest
+
+from cpm_core import CpmDisk, DPB_IBM_3740, HostDisk, OverlayDiskImage, SharedBaseImage
+from cpm_image import (FORMATS, DiskFormat, blank_image, bulk_convert, copy_files, list_files, load_formats,
+                       load_image, save_image)
+
+IBM_3740 = FORMATS['ibm-3740']
+NAME = b'HELLO   TXT'
+
+
+def host_file(tmp_path, data: bytes) -> HostDisk:
+    os.makedirs(tmp_path / 'src' / '0')
+    (tmp_path / 'src' / '0' / 'HELLO.TXT').write_bytes(data)
+    return HostDisk(str(tmp_path / 'src'))
+
+
+def test_copy_reports_full_disk_on_last_partial_record(tmp_path):
+    disk = blank_image(IBM_3740)
+    data_blocks = DPB_IBM_3740.block_count - len(DPB_IBM_3740.directory_blocks)
+    src = host_file(tmp_path, b'x' * (data_blocks * DPB_IBM_3740.block_size + 10))
+    with pytest.raises(OSError):
+        copy_files(src, disk)
+
+
+def test_logical_export_can_back_an_overlay(tmp_path):
+    data = bytes(range(256)) * 40 + b'tail'
+    disk = blank_image(IBM_3740)
+    assert copy_files(host_file(tmp_path, data), disk) == 1
+
+    physical, logical = tmp_path / 'physical.img', tmp_path / 'logical.img'
+    save_image(disk, str(physical), IBM_3740)
+    save_image(disk, str(logical), IBM_3740, logical=True)
+    assert physical.read_bytes() != logical.read_bytes()
+
+    base = SharedBaseImage.get(str(logical))
+    try:
+        overlay = CpmDisk(OverlayDiskImage(base, DPB_IBM_3740))
+        assert list_files(overlay) == [(0, NAME)]
+        assert b''.join(overlay.read_file(0, NAME)).rstrip(b'\x1a') == data
+    finally:
+        base.release()
+
+
+def test_format_file_reaches_bulk_workers(tmp_path):
+    custom = dataclasses.replace(IBM_3740, name='test-3740-skew5', skew=5)
+    format_file = tmp_path / 'formats.json'
+    format_file.write_text(json.dumps([custom.to_dict()]))
+    FORMATS.pop(custom.name, None)
+    assert load_formats(str(format_file)) == [custom]
+    assert DiskFormat.from_dict(custom.to_dict()) == custom
+
+    src_dir = tmp_path / 'images'
+    os.makedirs(src_dir)
+    disk = blank_image(IBM_3740)
+    copy_files(host_file(tmp_path, b'hello'), disk)
+    for index in range(3):
+        save_image(disk, str(src_dir / f'{index}.img'), IBM_3740)
+
+    paths = sorted(str(path) for path in src_dir.iterdir())
+    results = bulk_convert(paths, str(tmp_path / 'dst'), IBM_3740, FORMATS[custom.name], jobs=2)
+    assert [(count, error) for _, count, error in results] == [(1, None)] * 3
+    converted = load_image(str(tmp_path / 'dst' / '0.img'), custom)
+    assert list_files(converted) == [(0, NAME)]
+
+
+def test_bulk_refuses_to_overwrite_sources(tmp_path):
+    image = tmp_path / 'a.img'
+    save_image(blank_image(IBM_3740), str(image), IBM_3740)
+    with pytest.raises(ValueError):
+        bulk_convert([str(image)], str(tmp_path), IBM_3740, IBM_3740)
+    with pytest.raises(ValueError):
+        DiskFormat.from_dict({'name': 'broken', 'tracks': 1})
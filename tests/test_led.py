@@ -0,0 +1,82 @@
+import struct
+import sys
+import types
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import led_compile
+from led_compile import led_anim
+
+
+def stub(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    return module
+
+
+@pytest.fixture
+def tlc5940(monkeypatch):
+    # the board modules only exist on CircuitPython, gs_data_to_bytes needs none of them
+    board = 'adafruit_blinka.microcontroller.generic_agnostic_board'
+    modules = {
+        'adafruit_bus_device': stub('adafruit_bus_device', spi_device=stub('spi_device')),
+        'digitalio': stub('digitalio'),
+        'busio': stub('busio', SPI=object),
+        'pwmio': stub('pwmio'),
+        'adafruit_blinka': stub('adafruit_blinka'),
+        'adafruit_blinka.microcontroller': stub('adafruit_blinka.microcontroller'),
+        board: stub(board, pin=stub('pin', Pin=object)),
+    }
+    for name, module in modules.items():
+        monkeypatch.setitem(sys.modules, name, module)
+    monkeypatch.delitem(sys.modules, 'tlc5940', raising=False)
+    import tlc5940
+    return tlc5940
+
+
+def test_pack_frames_matches_gs_data_to_bytes(tlc5940):
+    rng = np.random.default_rng(5940)
+    frames = rng.integers(0, 0x1000, size=(50, led_anim.CHANNELS), dtype=np.uint16)
+    frames[0] = 0
+    frames[1] = 0xFFF
+    frames[2] = [0xFFF * (channel % 2) for channel in range(led_anim.CHANNELS)]
+    expected = b''.join(bytes(tlc5940.gs_data_to_bytes([int(value) for value in frame])) for frame in frames)
+    assert led_compile.pack_frames(frames) == expected
+
+
+def test_compile_animation_header():
+    frames = np.zeros((3, led_anim.CHANNELS), dtype=np.uint16)
+    data = led_compile.compile_animation(frames, 60)
+    assert led_anim.unpack_header(data) == (60, 3)
+    assert len(data) == led_anim.HEADER_SIZE + 3 * led_anim.FRAME_SIZE
+
+
+@pytest.mark.parametrize('fps', [0, -1, led_anim.MAX_FPS + 1])
+def test_fps_out_of_range(fps, tmp_path, capsys):
+    with pytest.raises(ValueError):
+        led_anim.pack_header(fps, 1)
+
+    src = tmp_path / 'frames.csv'
+    src.write_text(','.join(['0'] * led_anim.CHANNELS))
+    with pytest.raises(SystemExit) as exit:
+        led_compile.main([str(src), str(tmp_path / 'out.tlc'), '--fps', str(fps)])
+    assert exit.value.code == 2
+    assert 'fps must be between 1 and 65535' in capsys.readouterr().err
+    assert not (tmp_path / 'out.tlc').exists()
+
+
+def test_fps_limits(tmp_path):
+    src = tmp_path / 'frames.csv'
+    src.write_text(','.join(['0'] * led_anim.CHANNELS))
+    for fps in (1, led_anim.MAX_FPS):
+        assert led_compile.main([str(src), str(tmp_path / 'out.tlc'), '--fps', str(fps)]) == 0
+        assert led_anim.unpack_header((tmp_path / 'out.tlc').read_bytes()) == (fps, 1)
+
+
+def test_unpack_header_rejects_zero_fps():
+    header = struct.pack(led_anim.HEADER, led_anim.MAGIC, led_anim.VERSION, led_anim.CHANNELS, 0, 1,
+                         led_anim.FRAME_SIZE)
+    with pytest.raises(ValueError):
+        led_anim.unpack_header(header)
@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from cpm_core import (BdosOpcode, BdosReturn, CpmDisk, DPB_IBM_3740, Fcb, LockManager, MemoryDiskImage,
+                      ccp_loop, create_session)
+
+NAME = b'SHARED  DAT'
+
+
+def shared_sessions():
+    locks = LockManager()
+    disk = CpmDisk(MemoryDiskImage(DPB_IBM_3740))
+    return locks, create_session(locks, disk), create_session(locks, disk)
+
+
+def new_fcb(unlocked: bool = False) -> Fcb:
+    fcb = Fcb()
+    fcb.data[1:12] = NAME
+    if unlocked:
+        fcb.data[5] |= 0x80
+    return fcb
+
+
+def test_locked_open_excludes_other_sessions():
+    locks, (_, _, first), (_, _, second) = shared_sessions()
+    fcb = new_fcb()
+    assert first.call(BdosOpcode.MAKE, fcb) == BdosReturn.OK
+    assert second.call(BdosOpcode.OPEN, new_fcb()) == BdosReturn.FILE_IN_USE
+    assert second.call(BdosOpcode.DELETE, new_fcb()) == BdosReturn.FILE_IN_USE
+
+    assert first.call(BdosOpcode.CLOSE, fcb) == BdosReturn.OK
+    assert second.call(BdosOpcode.OPEN, new_fcb()) == BdosReturn.OK
+
+
+def test_record_locks_in_unlocked_mode():
+    locks, (_, _, first), (_, _, second) = shared_sessions()
+    assert first.call(BdosOpcode.MAKE, new_fcb(unlocked=True)) == BdosReturn.OK
+    mine, theirs = new_fcb(unlocked=True), new_fcb(unlocked=True)
+    assert first.call(BdosOpcode.OPEN, mine) == BdosReturn.OK
+    assert second.call(BdosOpcode.OPEN, theirs) == BdosReturn.OK
+
+    assert first.call(BdosOpcode.LOCK_RECORD, mine) == BdosReturn.OK
+    assert second.call(BdosOpcode.LOCK_RECORD, theirs) == BdosReturn.RECORD_LOCKED
+    assert second.call(BdosOpcode.WRITE_RANDOM, theirs) == BdosReturn.RECORD_LOCKED
+
+    async def wait_for_unlock():
+        waiter = asyncio.create_task(second.wait_record(theirs))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        first.call(BdosOpcode.UNLOCK_RECORD, mine)
+        return await waiter
+
+    assert asyncio.run(wait_for_unlock()) == BdosReturn.OK
+    assert second.call(BdosOpcode.WRITE_RANDOM, theirs) == BdosReturn.OK
+
+
+def test_failed_session_releases_its_locks():
+    locks, (state, bios, first), (_, _, second) = shared_sessions()
+    bios.set_printer(None)
+
+    async def reader(prompt):
+        assert first.call(BdosOpcode.MAKE, new_fcb()) == BdosReturn.OK
+        raise RuntimeError('console went away')
+
+    bios.set_reader(reader)
+    with pytest.raises(RuntimeError):
+        asyncio.run(ccp_loop(state, bios, first))
+
+    assert locks.stats()['open_files'] == 0
+    assert second.call(BdosOpcode.OPEN, new_fcb()) == BdosReturn.OK
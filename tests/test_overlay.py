@@ -0,0 +1,88 @@
+import pytest
+
+from cpm_core import (CpmDisk, DPB_IBM_3740, EMPTY_BYTE, MemoryDiskImage, OverlayDiskImage, RECORD_SIZE,
+                      SharedBaseImage)
+
+RECORDS = DPB_IBM_3740.total_records
+
+
+@pytest.fixture
+def base_path(tmp_path):
+    path = tmp_path / 'base.img'
+    path.write_bytes(bytes(index & 0xFF for index in range(RECORDS * RECORD_SIZE)))
+    return str(path)
+
+
+def record(value: int) -> bytes:
+    return bytes([value]) * RECORD_SIZE
+
+
+def test_base_is_shared_and_refcounted(base_path):
+    first = OverlayDiskImage(base_path, DPB_IBM_3740)
+    second = OverlayDiskImage(base_path, DPB_IBM_3740)
+    assert first.base is second.base
+    assert first.base.users == 2
+
+    first.close()
+    assert SharedBaseImage.get(base_path) is second.base
+    assert second.read_records(0, 1) == bytes(range(RECORD_SIZE))
+
+    second.close()
+    assert second.base.users == 0
+    fresh = SharedBaseImage.get(base_path)
+    assert fresh is not second.base
+    fresh.users += 1
+    fresh.release()
+
+
+def test_overlay_stays_sparse(base_path):
+    overlay = OverlayDiskImage(base_path, DPB_IBM_3740)
+    original = overlay.read_records(10, 1)
+    overlay.write_records(10, record(1) + record(2))
+    overlay.write_records(500, record(3))
+    assert overlay.overlay_records == 3
+
+    # writing the base contents back frees the record again
+    overlay.write_records(10, original)
+    assert overlay.overlay_records == 2
+    assert overlay.read_records(10, 2) == original + record(2)
+    overlay.close()
+
+
+def test_snapshot_restore_discard(base_path):
+    overlay = OverlayDiskImage(base_path, DPB_IBM_3740)
+    base = overlay.read_records(0, 4)
+    overlay.write_records(1, record(7))
+    snapshot = overlay.snapshot()
+
+    overlay.write_records(2, record(8))
+    overlay.restore(snapshot)
+    assert overlay.read_records(0, 4) == base[:RECORD_SIZE] + record(7) + base[2 * RECORD_SIZE:]
+
+    overlay.discard()
+    assert overlay.overlay_records == 0
+    assert overlay.read_records(0, 4) == base
+    overlay.close()
+
+
+def test_read_into_matches_read_records(base_path):
+    overlay = OverlayDiskImage(base_path, DPB_IBM_3740)
+    overlay.write_records(3, record(9))
+    dest = bytearray(8 * RECORD_SIZE)
+    overlay.read_into(0, memoryview(dest))
+    assert bytes(dest) == overlay.read_records(0, 8)
+
+    # past the end of a short base reads as empty
+    overlay.read_into(RECORDS, memoryview(dest)[:RECORD_SIZE])
+    assert bytes(dest[:RECORD_SIZE]) == bytes([EMPTY_BYTE]) * RECORD_SIZE
+    overlay.close()
+
+
+def test_cpm_disk_on_an_overlay(tmp_path):
+    path = tmp_path / 'empty.img'
+    path.write_bytes(bytes(MemoryDiskImage(DPB_IBM_3740).read_records(0, RECORDS)))
+    overlay = OverlayDiskImage(str(path), DPB_IBM_3740)
+    disk = CpmDisk(overlay)
+    assert disk.search(0, b'?' * 11) == []
+    assert overlay.overlay_records == 0
+    overlay.close()
@@ -0,0 +1,50 @@
+import asyncio
+import json
+
+from cpm_core import ccp_loop, create_session
+from cpm_replay import SessionRecorder, SessionReplayer
+
+COMMANDS = ['dir', 'save 2 foo.com', 'era *.*', 'y', 'dir', 'exit']
+
+
+def record(path):
+    state, bios, bdos = create_session()
+    bios.set_printer(None)
+    lines = iter(COMMANDS)
+
+    async def reader(prompt):
+        return next(lines)
+
+    bios.set_reader(reader)
+    recorder = SessionRecorder(str(path))
+    recorder.attach(bios, bdos)
+    try:
+        asyncio.run(ccp_loop(state, bios, bdos))
+    finally:
+        recorder.close()
+
+
+def test_recording_contains_bdos_events(tmp_path):
+    path = tmp_path / 'session.jsonl'
+    record(path)
+    events = [json.loads(line) for line in path.read_text().splitlines()]
+
+    assert [event['value'] for event in events if event['kind'] == 'input'] == COMMANDS
+    assert [event['command'] for event in events if event['kind'] == 'input'] == [True, True, True, False, True, True]
+    ops = {event['op'] for event in events if event['kind'] == 'bdos'}
+    assert {'search', 'make', 'write', 'close', 'delete'} <= ops
+
+
+def test_replay_matches_recording(tmp_path):
+    path = tmp_path / 'session.jsonl'
+    record(path)
+
+    state, bios, bdos = create_session()
+    bios.set_printer(None)
+    replayer = SessionReplayer.load(str(path))
+    asyncio.run(replayer.run(state, bios, bdos))
+
+    report = replayer.report()
+    # 'y' answers ERA's prompt, so it is timed as part of 'era *.*'
+    assert [timing.value for timing in replayer.timings] == ['dir', 'save 2 foo.com', 'era *.*', 'dir']
+    assert not [line for line in report if line.startswith('BDOS') or line.startswith('Recording')]
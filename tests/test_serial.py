@@ -0,0 +1,66 @@
+import asyncio
+import os
+
+from cpm_core import DiskDrive, HostDisk, ccp_loop, create_session
+from cpm_serial import LoopbackTransport, SerialBridge, cpm_link
+
+
+class Board:
+    """The KB2040 side of the link, as KB_LED/code.py runs it."""
+    def __init__(self, transport):
+        self._transport = transport
+        self._decoder = cpm_link.FrameDecoder()
+        self.console = bytearray()
+
+    def type(self, text: str):
+        encoder = cpm_link.FrameEncoder()
+        encoder.add(cpm_link.MSG_KEY, text.encode('ascii'))
+        for frame in encoder.frames():
+            self._transport.write(frame)
+
+    def poll(self):
+        for msg_type, payload in self._decoder.feed(self._transport.read()):
+            if msg_type == cpm_link.MSG_CONSOLE:
+                self.console.extend(payload)
+
+
+def run_bridged(commands: str, disk=None) -> Board:
+    host, board_side = LoopbackTransport.pair()
+    board = Board(board_side)
+
+    async def main():
+        state, bios, bdos = create_session()
+        bios.set_printer(None)
+        if disk is not None:
+            bdos.mount(DiskDrive.A, disk)
+        bridge = SerialBridge(host, frame_interval=0)
+        bridge.attach(bios)
+        pump = asyncio.create_task(bridge.run())
+        board.type(commands)
+        try:
+            await asyncio.wait_for(ccp_loop(state, bios, bdos), timeout=30)
+            bridge.flush()
+        finally:
+            pump.cancel()
+        board.poll()
+
+    asyncio.run(main())
+    return board
+
+
+def test_keys_in_console_out():
+    board = run_bridged('dir\rfo\x08x\rexit\r')
+    console = board.console.decode('ascii')
+    assert console.startswith('CP/M VER 2.0\n')
+    assert 'A0>dir\nCPM: dir\nNO FILE\n' in console
+    assert 'A0>fo\x08 \x08x\nFX?\n' in console
+    assert console.endswith('A0>exit\n')
+
+
+def test_type_of_large_file_loses_no_output(tmp_path):
+    os.makedirs(tmp_path / '0')
+    text = ''.join(f'{index:07d} the quick brown fox\n' for index in range(40000))
+    (tmp_path / '0' / 'BIG.TXT').write_text(text)
+
+    board = run_bridged('type big.txt\rexit\r', HostDisk(str(tmp_path), buffer_size=4096))
+    assert text in board.console.decode('ascii')
@@ -0,0 +1,62 @@
+import json
+
+from cpm_core import BdosOpcode, Stats
+
+
+def test_disabled_stats_record_nothing(session):
+    console, state, bios, bdos = session('dir', 'save 1 foo.com', 'type foo.com')
+    assert not state.stats.enabled
+    assert not state.stats.commands
+    assert not state.stats.bdos
+    assert not state.stats.bios
+
+
+def test_enabled_stats_time_commands_bdos_and_bios(session):
+    console, state, bios, bdos = session('stats on', 'dir', 'save 1 foo.com')
+    stats = state.stats
+    assert stats.enabled
+    assert stats.commands['dir'].count == 1
+    assert stats.commands['save'].count == 1
+    assert stats.bdos[BdosOpcode.SEARCH.value].count == 1
+    assert stats.bdos[BdosOpcode.WRITE.value].count == 2
+    assert stats.bios['print'].count > 0
+
+
+def test_stats_actions(session):
+    console, state, bios, bdos = session('stats on', 'dir', 'stats', 'stats off', 'dir', 'stats bogus')
+    assert 'Stats on' in console
+    assert 'CMD  dir          n=1' in console
+    assert 'BDOS search' in console
+    assert 'A: read 2048B written 0B' in console
+    assert 'BOGUS?' in console
+    assert state.stats.commands['dir'].count == 1
+
+    console, state, *_ = session('stats on', 'dir', 'stats reset', 'stats')
+    assert 'Stats on' in console
+    assert 'CMD  dir' not in console
+    assert state.stats.commands.keys() == {'stats'}
+
+
+def test_stats_json(session, tmp_path):
+    path = tmp_path / 'stats.json'
+    console, state, bios, bdos = session('stats on', 'dir', f'stats json {path}', 'stats json')
+    saved = json.loads(path.read_text())
+    assert saved['enabled'] is True
+    assert saved['commands']['dir']['count'] == 1
+    assert saved['drives']['A']['bytes_read'] == 2048
+    assert 'locks' in saved
+    printed = console[console.index('{'):console.rindex('}') + 1]
+    assert json.loads(printed)['commands']['dir']['count'] == 1
+
+    console, state, *_ = session(f'stats json {tmp_path / "missing" / "stats.json"}')
+    assert 'Unable to write' in console
+    assert 'Unable to write' in state.error_message.entries[0]
+
+
+def test_snapshot_without_bdos():
+    stats = Stats(enabled=True)
+    stats.record_command('dir', 0.001)
+    snapshot = stats.snapshot()
+    assert snapshot['commands']['dir']['count'] == 1
+    assert snapshot['drives'] == {}
+    assert 'locks' not in snapshot